@@ -1,95 +1,64 @@
 import os
 import logging
+import functools
 from datetime import datetime
+import numpy as np
 from config import ApplicationConfig
 from ui_manager import UIManager
-from document_processor import DocumentProcessor
-from search_engine import SearchEngine
-from vector_store import VectorStore
+from utils import SIZE_UNITS, json_dumps, open_with_default_app
 from pathlib import Path
 import shutil
-import platform
-import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Setup logging
-logging.basicConfig(level=logging.DEBUG)
+# Setup logging; DEBUG logs every request, so it is opt-in via LOG_LEVEL
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger("semantic_search")
 
-try:
-    from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-    from werkzeug.utils import secure_filename
-except ImportError:
-    # Fallback for environments without Flask
-    logger.error("Flask dependencies not available. Simulating web environment for development.")
-    
-    # Define minimal classes to allow code to load without Flask
-    class Flask:
-        def __init__(self, *args, **kwargs):
-            self.config = {}
-            self.template_filter_funcs = {}
-            self.routes = {}
-            self.secret_key = None
-        
-        def route(self, rule, **options):
-            def decorator(f):
-                self.routes[rule] = f
-                return f
-            return decorator
-        
-        def template_filter(self, name=None):
-            def decorator(f):
-                self.template_filter_funcs[name or f.__name__] = f
-                return f
-            return decorator
-        
-        def run(self, **kwargs):
-            logger.info("Flask app would start here in a real environment")
-    
-    def render_template(template, **context):
-        logger.info(f"Would render {template} with {context}")
-        return f"<html><body>Template: {template}</body></html>"
-    
-    def redirect(url):
-        logger.info(f"Would redirect to {url}")
-        return url
-    
-    def url_for(endpoint, **values):
-        return f"/{endpoint}"
-    
-    def flash(message, category='message'):
-        logger.info(f"Flash message: {message} [{category}]")
-    
-    def jsonify(data):
-        import json
-        return json.dumps(data)
+from _flask_compat import (Flask, Request, Response, render_template, request, redirect,
+                           url_for, flash, jsonify, stream_with_context, secure_filename)
+
+# Configure uploads
+UPLOAD_FOLDER = 'uploads'
+DESKTOP_FOLDER = 'Desktop'
+DESKTOP_PATH = Path(os.path.expanduser("~"), DESKTOP_FOLDER)
+ALLOWED_EXTENSIONS = frozenset({'pdf', 'docx', 'xlsx', 'csv'})
+MAX_UPLOAD_SIZE = 1024 * 1024 * 1024      # Largest accepted upload request
+UPLOAD_SPOOL_SIZE = 64 * 1024 * 1024      # Uploaded files larger than this spill to disk
+UPLOAD_COPY_BUFFER = 1024 * 1024          # Buffer size used when saving uploaded files
+MAX_SEARCH_LIMIT = 200                    # Most results a single streamed search returns
+
+class UploadRequest(Request):
+    """Request that buffers uploaded files in memory up to UPLOAD_SPOOL_SIZE, then on disk"""
     
-    class secure_filename:
-        @staticmethod
-        def __call__(filename):
-            return filename.replace(' ', '_')
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
 
 # create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
+app.request_class = UploadRequest
 
-# Configure uploads
-UPLOAD_FOLDER = 'uploads'
-DESKTOP_FOLDER = 'Desktop'
-ALLOWED_EXTENSIONS = {'pdf', 'docx', 'xlsx', 'csv'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['DESKTOP_FOLDER'] = DESKTOP_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
 
 # Create upload directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
 # Define template filters
+@functools.lru_cache(maxsize=8192)
+def _format_timestamp(timestamp):
+    """Format a whole-second Unix timestamp, cached since many files share mtimes"""
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
 @app.template_filter('timestamp_to_date')
 def timestamp_to_date(timestamp):
     """Convert a Unix timestamp to formatted date string"""
     if not timestamp:
         return ""
-    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+    return _format_timestamp(int(timestamp))
 
 # Sample data to simulate indexed documents
 sample_documents = [
@@ -124,38 +93,91 @@ sample_documents = [
 
 def allowed_file(filename):
     """Check if file has an allowed extension"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def format_file_size(size_bytes):
-    """Format file size from bytes to a human-readable format"""
-    if size_bytes < 1024:
-        return f"{size_bytes} bytes"
-    elif size_bytes < 1024 * 1024:
-        return f"{size_bytes / 1024:.1f} KB"
-    elif size_bytes < 1024 * 1024 * 1024:
-        return f"{size_bytes / (1024 * 1024):.1f} MB"
-    else:
-        return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
+    _, dot, extension = filename.rpartition('.')
+    return bool(dot) and extension.lower() in ALLOWED_EXTENSIONS
+
+def add_display_fields(rows):
+    """
+    Return copies of file rows with 'size_display' and 'last_modified_display'
+    precomputed for the whole list at once, instead of per row while rendering
+    """
+    if not rows:
+        return []
+
+    # Pick each size's unit from its base-2 magnitude in a single vectorized pass
+    sizes = np.array([row.get('size') or 0 for row in rows], dtype=np.float64)
+    units = np.clip(np.log2(np.maximum(sizes, 1)) // 10, 0, 3).astype(int)
+    scaled = sizes / np.power(1024.0, units)
+
+    return [
+        dict(row,
+             size_display=f"{int(size)} bytes" if unit == 0 else f"{value:.1f} {SIZE_UNITS[unit][1]}",
+             last_modified_display=timestamp_to_date(row.get('last_modified')))
+        for row, size, unit, value in zip(rows, sizes, units, scaled)
+    ]
     
-# Initialize the document processor and search engine
-config_setup = ApplicationConfig()
-ui_manager_setup = UIManager()
-doc_processor = DocumentProcessor(config_setup, ui_manager_setup)
-
-vector_store_setup = VectorStore(config_setup.DEFAULTS['vector_db_path'])
-search_engine = SearchEngine(vector_store_setup, ui_manager_setup, config_setup)
+def iter_subfolders(folder_path):
+    """Recursively yield all subfolders using os.scandir's cached entry types"""
+    try:
+        with os.scandir(folder_path) as entries:
+            subfolders = [Path(entry.path) for entry in entries
+                          if entry.is_dir(follow_symlinks=False)]
+    except OSError as e:
+        logger.warning("Cannot scan folder %s: %s", folder_path, e)
+        return
+
+    for subfolder in subfolders:
+        yield subfolder
+        yield from iter_subfolders(subfolder)
+    
+# Lazily initialize the document processor and search engine, so loading the
+# embedding model is deferred until a route actually needs it
+@functools.lru_cache(maxsize=1)
+def get_config():
+    """Get the application configuration"""
+    return ApplicationConfig()
+
+@functools.lru_cache(maxsize=1)
+def get_ui_manager():
+    """Get the UI manager"""
+    return UIManager()
+
+@functools.lru_cache(maxsize=1)
+def get_vector_store():
+    """Get the vector store shared by searching and indexing"""
+    # Size torch's thread pool before torch is first imported, leaving cores for
+    # other workers; TORCH_NUM_THREADS overrides the default of half the CPUs
+    num_threads = int(os.environ.get('TORCH_NUM_THREADS', max(1, (os.cpu_count() or 1) // 2)))
+    os.environ.setdefault('OMP_NUM_THREADS', str(num_threads))
+    import torch
+    torch.set_num_threads(num_threads)
+
+    from vector_store import VectorStore
+    app_config = get_config()
+    return VectorStore(app_config.vector_db_path, index_type=app_config.index_type)
+
+@functools.lru_cache(maxsize=1)
+def get_search_engine():
+    """Get the search engine"""
+    from search_engine import SearchEngine
+    return SearchEngine(get_vector_store(), get_ui_manager(), get_config())
+
+@functools.lru_cache(maxsize=1)
+def get_doc_processor():
+    """Get the document processor"""
+    from document_processor import DocumentProcessor
+    return DocumentProcessor(get_config(), get_ui_manager(), vector_store=get_vector_store())
 
 # # Loop through the uploads folder and call the remove_document function for each file
 # for filename in os.listdir(app.config['UPLOAD_FOLDER']):
 #     file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 #     if os.path.isfile(file_path):
-#         vector_store_setup.remove_document(file_path)
+#         get_vector_store().remove_document(file_path)
 #         logger.info(f"Removed document from vector store: {file_path}")
 
 # # Reload any documents in uploads currently
 # upload_folder_path = Path(os.path.join(app.config['UPLOAD_FOLDER']))
-# doc_processor.index_directory(upload_folder_path, force = True)
+# get_doc_processor().index_directory(upload_folder_path, force = True)
 
 @app.route('/')
 def index():
@@ -177,23 +199,22 @@ def upload_file():
             flash('No selected file')
             return redirect(request.url)
         
-        success_count = 0
+        new_paths = []
         for file in files:
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                success_count += 1
-                logger.info(f"Saved file: {file_path}")
+                file_path = Path(app.config['UPLOAD_FOLDER'], filename)
+                # Copy in large blocks rather than werkzeug's default 16 KiB
+                file.save(file_path, buffer_size=UPLOAD_COPY_BUFFER)
+                new_paths.append(file_path)
+                logger.info("Saved file: %s", file_path)
             else:
                 flash(f'File type not allowed: {file.filename}')
         
-        if success_count > 0:
-            flash(f'Successfully uploaded {success_count} file(s)')
-            # In a real app, we would call the document processor to index the files here
-            upload_folder_path = Path(os.path.join(app.config['UPLOAD_FOLDER']))
-            doc_processor.index_directory(upload_folder_path)
-            vector_store_setup.reload_index()
+        if new_paths:
+            flash(f'Successfully uploaded {len(new_paths)} file(s)')
+            # Index only the files saved by this request, not the whole uploads folder
+            get_doc_processor().index_files(new_paths, batch_size=32)
 
         return redirect(url_for('upload_file'))
             
@@ -201,18 +222,18 @@ def upload_file():
     
     # List already uploaded files
     uploaded_files = []
-    for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.isfile(file_path):
-            file_stat = os.stat(file_path)
-            uploaded_files.append({
-                'filename': filename,
-                'path': file_path,
-                'size': format_file_size(file_stat.st_size),
-                'last_modified': file_stat.st_mtime
-            })
+    with os.scandir(app.config['UPLOAD_FOLDER']) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                file_stat = entry.stat()
+                uploaded_files.append({
+                    'filename': entry.name,
+                    'path': entry.path,
+                    'size': file_stat.st_size,
+                    'last_modified': file_stat.st_mtime
+                })
     
-    return render_template('upload.html', files=uploaded_files)
+    return render_template('upload.html', files=add_display_fields(uploaded_files))
 
 @app.route('/search', methods=['GET', 'POST'])
 def search():
@@ -223,10 +244,24 @@ def search():
     if query:
         # In a real app, we would call the search engine here
         # For now, we'll return sample data
-        results = search_engine.search(query)
+        results = add_display_fields(get_search_engine().search(query))
     
     return render_template('search.html', query=query, results=results)
 
+@app.route('/search.json', methods=['GET'])
+def search_json():
+    """Stream search results as newline-delimited JSON, one result per line"""
+    query = request.args.get('query', '')
+    limit = min(max(request.args.get('limit', 5, type=int), 1), MAX_SEARCH_LIMIT)
+
+    def generate():
+        if not query:
+            return
+        for result in get_search_engine().search_stream(query, limit=limit):
+            yield json_dumps(result) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/config', methods=['GET', 'POST'])
 def config():
     """Configuration page"""
@@ -249,26 +284,36 @@ def config():
 @app.route('/reindex', methods=['GET'])
 def reindex():
     
-    upload_folder_path = Path(os.path.join(os.path.expanduser("~"), app.config['DESKTOP_FOLDER']))
-    logger.info(f"Reindexing main folder: {upload_folder_path}")
-
-    # Index the main desktop folder
-    ret_val = doc_processor.index_directory(upload_folder_path)
-    if not ret_val:
-        flash(f"Some error occurred while reindexing folder: {upload_folder_path}")
-    else:
-        # Recursively reindex all subfolders within the desktop folder
-        for subfolder in upload_folder_path.rglob('*'):
-            if subfolder.is_dir():
-                logger.info(f"Reindexing subfolder: {subfolder}")
-                ret_val = doc_processor.index_directory(subfolder)
-
-                if not ret_val:
-                    flash(f"Some error occurred while reindexing subfolder: {subfolder}")
-                    break
-
-    vector_store_setup.reload_index()
-    flash("All files and subfolders reindexed successfully")
+    upload_folder_path = DESKTOP_PATH
+    logger.info("Reindexing main folder: %s", upload_folder_path)
+
+    # Index the desktop folder and each of its subfolders non-recursively in
+    # parallel, so every file is visited once and a slow folder doesn't stall the others
+    folders = [upload_folder_path] + list(iter_subfolders(upload_folder_path))
+    found_documents = False
+    failed = False
+
+    doc_processor = get_doc_processor()
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = {
+            executor.submit(doc_processor.index_directory, folder,
+                            recursive=False, show_progress=False): folder
+            for folder in folders
+        }
+        for future in as_completed(futures):
+            folder = futures[future]
+            try:
+                # False only means the folder holds no supported documents
+                found_documents = future.result() or found_documents
+            except Exception as e:
+                failed = True
+                logger.error("Error reindexing folder %s: %s", folder, e)
+                flash(f"Some error occurred while reindexing folder: {folder}")
+
+    if not found_documents:
+        flash(f"No supported documents found in: {upload_folder_path}")
+    elif not failed:
+        flash("All files and subfolders reindexed successfully")
 
     return render_template('index.html')
 
@@ -277,32 +322,36 @@ def about():
     """About page"""
     return render_template('about.html')
 
+def is_indexed_path(file_path):
+    """
+    Check that a path from the frontend refers to an indexed document, so only
+    search results can be opened and arbitrary paths are rejected
+    """
+    if not file_path:
+        return False
+    return get_vector_store().contains_path(os.path.abspath(file_path))
+
 @app.route('/handle-file', methods=['POST'])
 def open_file():
     """Handle file opening requests from the frontend."""
     try:
         # Parse the JSON data from the request
         data = request.get_json()
-        logger.info(f"Received data: {data}")  # Log the received data
+        logger.debug("Received data: %s", data)  # Log the received data
 
         file_path = data.get('path')
-        if not file_path or not os.path.exists(file_path):
-            logger.error(f"File not found: {file_path}")
-            return jsonify({'error': 'File not found'}), 404
+        if not is_indexed_path(file_path):
+            logger.error("File not indexed: %s", file_path)
+            return jsonify({'error': 'File not indexed'}), 404
 
         # Open the file using the system's default application
-        if platform.system() == 'Windows':
-            os.startfile(file_path)
-        elif platform.system() == 'Darwin':  # macOS
-            subprocess.run(['open', file_path], check=True)
-        else:  # Linux
-            subprocess.run(['xdg-open', file_path], check=True)
-
-        logger.info(f"File opened successfully: {file_path}")
+        open_with_default_app(file_path)
+
+        logger.info("File opened successfully: %s", file_path)
         return jsonify({'message': 'File opened successfully'}), 200
 
     except Exception as e:
-        logger.error(f"Error opening file: {str(e)}")
+        logger.error("Error opening file: %s", e)
         return jsonify({'error': str(e)}), 500
     
 
@@ -312,27 +361,22 @@ def open_folder():
     try:
         # Parse the JSON data from the request
         data = request.get_json()
-        logger.info(f"Received data: {data}")  # Log the received data
+        logger.debug("Received data: %s", data)  # Log the received data
 
         file_path = data.get('path')
-        if not file_path or not os.path.exists(file_path):
-            logger.error(f"File not found: {file_path}")
-            return jsonify({'error': 'File not found'}), 404
+        if not is_indexed_path(file_path):
+            logger.error("File not indexed: %s", file_path)
+            return jsonify({'error': 'File not indexed'}), 404
 
         # Get the folder containing the file and open it using the system's default file explorer
         folder_path = os.path.dirname(file_path)
-        if platform.system() == 'Windows':
-            os.startfile(folder_path)
-        elif platform.system() == 'Darwin':  # macOS
-            subprocess.run(['open', folder_path], check=True)
-        else:  # Linux
-            subprocess.run(['xdg-open', folder_path], check=True)
-
-        logger.info(f"Folder opened successfully: {folder_path}")
+        open_with_default_app(folder_path)
+
+        logger.info("Folder opened successfully: %s", folder_path)
         return jsonify({'message': 'Folder opened successfully'}), 200
 
     except Exception as e:
-        logger.error(f"Folder opening file: {str(e)}")
+        logger.error("Folder opening file: %s", e)
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
@@ -1,6 +1,12 @@
 from huggingface_hub import hf_hub_download
 import re
 
+# Match URLs like:
+# https://huggingface.co/<repo_id>/resolve/<revision>/<filename>
+_HF_URL_RE = re.compile(
+    r"https?://huggingface\.co/([^/]+/[^/]+)/resolve/([^/]+)/(.+)"
+)
+
 def cached_download(**kwargs):
     """
     Shim for legacy `cached_download(url=...)` using hf_hub_download.
@@ -9,11 +15,7 @@ def cached_download(**kwargs):
     if url is None:
         raise ValueError("Expected 'url' keyword argument in cached_download")
 
-    # Match URLs like:
-    # https://huggingface.co/<repo_id>/resolve/<revision>/<filename>
-    match = re.match(
-        r"https?://huggingface\.co/([^/]+/[^/]+)/resolve/([^/]+)/(.+)", url
-    )
+    match = _HF_URL_RE.match(url)
 
     if not match:
         raise ValueError(f"Unsupported URL format: {url}")
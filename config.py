@@ -3,15 +3,21 @@ Configuration Module
 Manages application configuration settings.
 """
 import os
-import json
 import logging
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 
-from utils import get_app_data_dir
+from utils import get_app_data_dir, json_loads, json_dumps
 
 logger = logging.getLogger("semantic_search")
 
+# Parsed configuration files keyed by path, with the modification time they were read at
+_CONFIG_CACHE: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+
+# FAISS index types the vector store can build. Kept here rather than read from
+# vector_store, so loading the configuration doesn't import torch and FAISS
+INDEX_TYPES = ('flat', 'fp16', 'sq8', 'hnsw', 'ivf', 'pq', 'pca')
+
 class ApplicationConfig:
     """Class to manage application configuration"""
     
@@ -21,7 +27,9 @@ class ApplicationConfig:
         'vector_db_path': str(get_app_data_dir() / "vector_db"),
         'embedding_model': 'all-MiniLM-L6-v2',
         'chunk_size': 1000,
-        'chunk_overlap': 200
+        'chunk_overlap': 200,
+        'index_type': 'sq8',
+        'skip_scanned_pages': True
     }
     
     def __init__(self, config_path: Optional[str] = None):
@@ -84,6 +92,10 @@ class ApplicationConfig:
             logger.error(f"Invalid value type for {key}: expected {expected_type.__name__}")
             return False
         
+        if key == 'index_type' and value not in INDEX_TYPES:
+            logger.error(f"Invalid index type: {value} (expected one of {', '.join(INDEX_TYPES)})")
+            return False
+        
         # Update configuration
         self.config[key] = value
         
@@ -106,19 +118,32 @@ class ApplicationConfig:
         self._save_config()
     
     def _load_config(self) -> None:
-        """Load configuration from file"""
-        if not os.path.exists(self.config_path):
+        """Load configuration from file, reusing the parsed file if it is unchanged"""
+        try:
+            mtime_ns = os.stat(self.config_path).st_mtime_ns
+        except FileNotFoundError:
             logger.info(f"Configuration file not found, using defaults: {self.config_path}")
             return
         
         try:
-            with open(self.config_path, 'r') as f:
-                loaded_config = json.load(f)
+            cached = _CONFIG_CACHE.get(self.config_path)
+            if cached is not None and cached[0] == mtime_ns:
+                loaded_config = cached[1]
+            else:
+                with open(self.config_path, 'rb') as f:
+                    loaded_config = json_loads(f.read())
+                _CONFIG_CACHE[self.config_path] = (mtime_ns, loaded_config)
                 
             # Update configuration with loaded values
             for key, value in loaded_config.items():
                 if key in self.DEFAULTS:
                     self.config[key] = value
+            
+            # An unknown index type would make every vector store access fail
+            if self.config['index_type'] not in INDEX_TYPES:
+                logger.warning(f"Invalid index type in configuration: {self.config['index_type']}, "
+                               f"using {self.DEFAULTS['index_type']}")
+                self.config['index_type'] = self.DEFAULTS['index_type']
                     
             logger.debug(f"Loaded configuration from {self.config_path}")
             
@@ -131,8 +156,12 @@ class ApplicationConfig:
             # Create directory if it doesn't exist
             os.makedirs(os.path.dirname(self.config_path), exist_ok=True)
             
-            with open(self.config_path, 'w') as f:
-                json.dump(self.config, f, indent=2)
+            with open(self.config_path, 'wb') as f:
+                f.write(json_dumps(self.config, indent=True))
+            
+            # Keep the cache in step with what was just written
+            _CONFIG_CACHE[self.config_path] = (os.stat(self.config_path).st_mtime_ns,
+                                               self.config.copy())
                 
             logger.debug(f"Saved configuration to {self.config_path}")
             
@@ -165,3 +194,13 @@ class ApplicationConfig:
     def chunk_overlap(self) -> int:
         """Get the text chunk overlap"""
         return self.get('chunk_overlap')
+    
+    @property
+    def index_type(self) -> str:
+        """Get the vector index type"""
+        return self.get('index_type')
+    
+    @property
+    def skip_scanned_pages(self) -> bool:
+        """Get whether image-only PDF pages are skipped"""
+        return self.get('skip_scanned_pages')
@@ -3,69 +3,280 @@ Document Processor Module
 Handles extraction of text from various document formats (PDF, Word, Excel)
 and processing into embeddings for semantic search.
 """
+import io
 import os
+import mmap
 import time
+import shutil
+import sqlite3
+import subprocess
+import zipfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Any, Generator, Tuple
+from typing import List, Dict, Any, BinaryIO, Generator, Optional, Tuple, Union
 import logging
-import hashlib
 
 # Document parsing libraries
 import pypdf
 import docx
 import pandas as pd
+from lxml import etree
 from openpyxl import load_workbook
 
+try:
+    # PyMuPDF parses PDFs in C, much faster than pypdf
+    import fitz
+except ImportError:
+    fitz = None
+
 # Progress tracking
 from rich.progress import Progress, TextColumn, BarColumn, TimeElapsedColumn, TimeRemainingColumn
 
 # Local modules
 from config import ApplicationConfig
 from ui_manager import UIManager
+from utils import chunk_text_strings, content_hasher
 
 logger = logging.getLogger("semantic_search")
 
+# WordprocessingML element tags, and a parser that never resolves entities
+_W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_W_BODY, _W_P, _W_T = _W_NS + 'body', _W_NS + 'p', _W_NS + 't'
+_W_TBL, _W_TR, _W_TC = _W_NS + 'tbl', _W_NS + 'tr', _W_NS + 'tc'
+_DOCX_XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, huge_tree=True)
+
+# Document processor owned by each parsing worker process
+_worker_processor = None
+
+def _init_parse_worker(config: ApplicationConfig) -> None:
+    """Create the document processor used by a parsing worker process"""
+    global _worker_processor
+    _worker_processor = DocumentProcessor(config, UIManager())
+
+def _open_source(file_path: Path, data: Optional[bytes]) -> Union[Path, BinaryIO]:
+    """Get what a parser should read: the file contents if already loaded, else the path"""
+    return file_path if data is None else io.BytesIO(data)
+
+def _parse_file(file_path: Path) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Parse and hash a document in a parsing worker process"""
+    return _worker_processor._parse_file(file_path)
+
+def _extract_pdf_pages(file_path: Path, start: int, stop: int) -> List[str]:
+    """Extract the text of a range of PDF pages with PyMuPDF in a parsing worker process"""
+    with fitz.open(str(file_path)) as doc:
+        return _worker_processor._extract_mupdf_pages(doc, start, stop)
+
+class _MetadataDB:
+    """SQLite store of metadata about indexed files, keyed by path"""
+    
+    def __init__(self, data_dir: Path):
+        """
+        Open (creating if needed) the metadata database in the data directory,
+        migrating a legacy index_metadata.json on first run
+        
+        Args:
+            data_dir: Application data directory
+        """
+        os.makedirs(data_dir, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(data_dir / "index_metadata.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "path TEXT PRIMARY KEY, hash TEXT, size INTEGER, mtime REAL, last_indexed REAL)"
+        )
+        self._conn.commit()
+        
+        self._migrate_json(data_dir / "index_metadata.json")
+    
+    def _migrate_json(self, json_path: Path) -> None:
+        """Import the metadata of the former JSON store and remove the file"""
+        import json
+        
+        if not json_path.exists():
+            return
+            
+        try:
+            with open(json_path, 'r') as f:
+                legacy = json.load(f)
+        except Exception as e:
+            logger.error(f"Error loading index metadata: {str(e)}")
+            return
+            
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)",
+                [(path, entry.get('hash', ''), entry.get('size'),
+                  entry.get('last_indexed_mtime', 0), entry.get('last_indexed', 0))
+                 for path, entry in legacy.items()]
+            )
+        json_path.unlink()
+        logger.info(f"Migrated metadata of {len(legacy)} files to SQLite")
+    
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the metadata of an indexed file
+        
+        Args:
+            path: Absolute path of the file
+            
+        Returns:
+            Metadata dictionary, or None if the file has not been indexed
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hash, size, mtime, last_indexed FROM metadata WHERE path = ?", (path,)
+            ).fetchone()
+            
+        if row is None:
+            return None
+        return {'hash': row[0], 'size': row[1], 'last_indexed_mtime': row[2], 'last_indexed': row[3]}
+    
+    def upsert(self, path: str, file_hash: str, size: int, mtime: float) -> None:
+        """
+        Record that a file has just been indexed (visible to readers once committed)
+        
+        Args:
+            path: Absolute path of the file
+            file_hash: Hash of the file contents
+            size: File size in bytes
+            mtime: File modification time when indexed
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)",
+                (path, file_hash, size, mtime, time.time())
+            )
+    
+    def commit(self) -> None:
+        """Commit the pending updates"""
+        with self._lock:
+            self._conn.commit()
+
 class DocumentProcessor:
     """Class to handle document processing and indexing"""
     
-    def __init__(self, config: ApplicationConfig, ui_manager: UIManager):
-        """Initialize the document processor with configuration"""
+    # Parsed documents are handed to the vector store once either limit is reached
+    EMBED_BATCH_DOCUMENTS = 32
+    EMBED_BATCH_CHARS = 150_000
+    
+    # Files submitted to the parsing workers at a time, per worker
+    PARSE_WINDOW_PER_WORKER = 2
+    
+    # Read size used when hashing files, and the size above which files are memory-mapped instead
+    HASH_CHUNK_SIZE = 1 << 20
+    HASH_MMAP_THRESHOLD = 8 << 20
+    
+    # Files up to this size are read once, and hashed from the bytes handed to the parser
+    FUSED_HASH_MAX_SIZE = 64 << 20
+    
+    # Formats whose converters need a path on disk rather than the file contents
+    PATH_ONLY_EXTENSIONS = frozenset({'.doc'})
+    
+    # Rows read from a CSV file at a time
+    CSV_CHUNK_ROWS = 100_000
+    
+    # PDF pages with a content stream this large but hardly any text are treated as scans
+    SCANNED_PAGE_CONTENT_BYTES = 1_000_000
+    SCANNED_PAGE_MAX_TEXT = 200
+    
+    # PDFs parsed on their own with at least this many pages are split over the parsing workers
+    PDF_PARALLEL_MIN_PAGES = 64
+    
+    def __init__(self, config: ApplicationConfig, ui_manager: UIManager, vector_store=None):
+        """
+        Initialize the document processor with configuration
+        
+        Args:
+            config: Application configuration
+            ui_manager: UI manager used for progress and messages
+            vector_store: Vector store to add documents to (optional, created on first use)
+        """
         self.config = config
         self.ui_manager = ui_manager
         self.supported_extensions = {
             '.pdf': self._process_pdf,
             '.docx': self._process_docx,
-            '.doc': self._process_docx,  # Note: .doc needs additional handling in implementation
+            '.doc': self._process_doc,
             '.xlsx': self._process_excel,
             '.xls': self._process_excel,
             '.csv': self._process_csv
         }
         
-    def index_directory(self, directory_path: Path, force: bool = False) -> bool:
+        # PDF extractors in order of preference; pypdf is always the last resort
+        self._pdf_extractors = []
+        if fitz is not None:
+            self._pdf_extractors.append(self._process_pdf_mupdf)
+        if shutil.which('pdftotext'):
+            self._pdf_extractors.append(self._process_pdf_pdftotext)
+        self._pdf_extractors.append(self._process_pdf_pypdf)
+        
+        # Converter for legacy binary .doc files, if one is installed
+        self._doc_converter = shutil.which('antiword') or shutil.which('catdoc')
+        
+        # Shared vector store and a lock guarding it and the index metadata,
+        # so several directories can be indexed concurrently
+        self._vector_store = vector_store
+        self._lock = threading.RLock()
+        
+        # Metadata about indexed files, opened on first use. It has a lock of its
+        # own, as the one above is held while batches are embedded
+        self._metadata_db = None
+        self._metadata_db_lock = threading.Lock()
+        
+        # Worker processes for CPU-bound parsing, created on first use
+        self._parse_pool = None
+        
+    def index_directory(self, directory_path: Path, force: bool = False,
+                        recursive: bool = True, show_progress: bool = True) -> bool:
         """
         Index all documents in the specified directory
         
         Args:
             directory_path: Path to the directory to index
             force: Whether to force reindexing of already indexed documents
+            recursive: Whether to include documents in subdirectories
+            show_progress: Whether to display a progress bar (disable when
+                indexing several directories concurrently)
             
         Returns:
             bool: True if indexing was successful
         """
         # Get list of files to index
-        files_to_index = self._get_indexable_files(directory_path)
-
-        files_to_index = [ Path(os.path.abspath(f)) for f in files_to_index]
+        files_to_index = self._get_indexable_files(directory_path, recursive)
         
         if not files_to_index:
             self.ui_manager.display_warning(f"No supported documents found in {directory_path}")
             return False
             
+        return self.index_files(files_to_index, force=force, show_progress=show_progress)
+    
+    def index_files(self, file_paths: List[Path], force: bool = False,
+                    batch_size: int = 32, show_progress: bool = True) -> bool:
+        """
+        Index the given documents, embedding them in batches
+        
+        Args:
+            file_paths: Paths of the documents to index
+            force: Whether to force reindexing of already indexed documents
+            batch_size: Number of texts embedded per model forward pass
+            show_progress: Whether to display a progress bar
+            
+        Returns:
+            bool: True if indexing was successful
+        """
+        files_to_index = [Path(os.path.abspath(f)) for f in file_paths]
+        
         # Check if we need to process them
         if not force:
             # Filter out already indexed files based on modification time and hash
-            index_metadata = self._load_index_metadata()
-            files_to_index = [f for f in files_to_index if self._needs_indexing(f, index_metadata)]
+            files_to_index = [f for f in files_to_index if self._needs_indexing(f)]
             
         if not files_to_index:
             self.ui_manager.display_message("All documents are already indexed and up to date")
@@ -75,185 +286,475 @@ class DocumentProcessor:
         total_files = len(files_to_index)
         self.ui_manager.display_message(f"Indexing {total_files} documents...")
         
-        processed_documents = []
+        # Parsed documents waiting to be embedded, and the batch being embedded
+        batch = []
+        batch_chars = 0
+        pending = None
+        
         logger.info("Starting indexing ...")
-        # Setup progress bar
-        with Progress(
-            TextColumn("[bold blue]{task.description}"),
-            BarColumn(bar_width=40),
-            "[progress.percentage]{task.percentage:>3.0f}%",
-            TimeElapsedColumn(),
-            TimeRemainingColumn(),
-            console=self.ui_manager.console
-        ) as progress:
-            
-            task = progress.add_task(f"[cyan]Processing documents...", total=total_files)
-            
-            for file_path in files_to_index:
-                try:
-                    # Extract text and metadata from document
-                    doc_content = self._process_document(file_path)
-                    if doc_content:
-                        processed_documents.append(doc_content)
+        try:
+            # Setup progress bar
+            with Progress(
+                TextColumn("[bold blue]{task.description}"),
+                BarColumn(bar_width=40),
+                "[progress.percentage]{task.percentage:>3.0f}%",
+                TimeElapsedColumn(),
+                TimeRemainingColumn(),
+                console=self.ui_manager.console,
+                disable=not show_progress
+            ) as progress, ThreadPoolExecutor(max_workers=1) as embedder:
+                
+                task = progress.add_task(f"[cyan]Processing documents...", total=total_files)
+                
+                for file_path, doc_content, file_hash, error in self._parse_files(files_to_index):
+                    if error is not None:
+                        logger.error(f"Error processing {file_path}: {str(error)}")
+                        self.ui_manager.display_warning(f"Skipped {file_path}: {str(error)}")
+                        
+                    elif doc_content:
+                        batch.append(doc_content)
+                        batch_chars += sum(len(chunk) for chunk in doc_content['chunks'])
                         
                         # Update metadata for this file
-                        file_hash = self._get_file_hash(file_path)
                         self._update_index_metadata(file_path, file_hash)
+                        
+                        # Embed full batches in the background while parsing continues,
+                        # keeping at most one batch in flight to bound memory
+                        if len(batch) >= self.EMBED_BATCH_DOCUMENTS or batch_chars >= self.EMBED_BATCH_CHARS:
+                            if pending is not None:
+                                pending.result()
+                            pending = embedder.submit(self._add_batch, batch, batch_size)
+                            batch = []
+                            batch_chars = 0
+                        
+                    else:
+                        # The document no longer has any text; drop its old chunks.
+                        # Changed documents with text are replaced by add_documents
+                        self._remove_from_vector_store(file_path)
                     
-                except Exception as e:
-                    logger.error(f"Error processing {file_path}: {str(e)}")
-                    self.ui_manager.display_warning(f"Skipped {file_path}: {str(e)}")
+                    # Update progress
+                    progress.update(task, advance=1)
                 
-                # Update progress
-                progress.update(task, advance=1)
-        
-        # Store processed documents in the vector database
-        if processed_documents:
-            self.ui_manager.display_message(f"Creating embeddings for {len(processed_documents)} documents...")
-            from vector_store import VectorStore
-            vector_store = VectorStore(self.config.vector_db_path)
-            vector_store.add_documents(processed_documents)
+                # Store the remaining documents in the vector database
+                if pending is not None:
+                    pending.result()
+                if batch:
+                    self._add_batch(batch, batch_size)
+        finally:
+            # Persist the metadata of everything parsed, even if indexing failed part way
+            self._flush_metadata()
             
         return True
     
-    def _get_indexable_files(self, directory_path: Path) -> List[Path]:
-        """Get all files that can be indexed from the directory"""
-        indexable_files = []
+    def _add_batch(self, documents: List[Dict[str, Any]], batch_size: int) -> None:
+        """
+        Embed a batch of documents into the vector store, one document at a
+        time if the batch does not fit in memory
+        
+        Args:
+            documents: Processed documents to add
+            batch_size: Number of texts embedded per model forward pass
+        """
+        logger.info(f"Creating embeddings for {len(documents)} documents...")
+        vector_store = self._get_vector_store()
         
-        for file_path in directory_path.glob('**/*'):
-            if file_path.is_file() and file_path.suffix.lower() in self.supported_extensions:
-                indexable_files.append(file_path)
+        try:
+            with self._lock:
+                vector_store.add_documents(documents, batch_size=batch_size)
+        except (MemoryError, RuntimeError) as e:
+            # torch reports GPU out-of-memory as a RuntimeError
+            if isinstance(e, RuntimeError) and "out of memory" not in str(e).lower():
+                raise
+            logger.warning(f"Out of memory embedding {len(documents)} documents, retrying one at a time")
+            for document in documents:
+                with self._lock:
+                    vector_store.add_documents([document], batch_size=1)
+    
+    def _parse_files(self, file_paths: List[Path]) -> Generator[Tuple[Path, Optional[Dict[str, Any]], Optional[str], Optional[Exception]], None, None]:
+        """
+        Parse and hash documents, spreading them over worker processes when there are several
+        
+        Args:
+            file_paths: Paths of the documents to parse
+            
+        Yields:
+            Tuple of path, document record, file hash and the error raised (if any),
+            in completion order
+        """
+        if len(file_paths) == 1:
+            # Not worth a round trip to the worker processes
+            try:
+                yield (file_paths[0], *self._parse_file(file_paths[0]), None)
+            except Exception as e:
+                yield file_paths[0], None, None, e
+            return
+        
+        # Keep a bounded number of files in flight, so parsed documents are handed
+        # on as they complete rather than piling up in finished futures
+        window = self.PARSE_WINDOW_PER_WORKER * (os.cpu_count() or 1)
+        remaining = deque(file_paths)
+        while remaining:
+            futures = {}
+            broken = []
+            parsed_any = False
+            pool_error = None
+            while remaining or futures:
+                while remaining and len(futures) < window and pool_error is None:
+                    file_path = remaining.popleft()
+                    try:
+                        future = self._get_parse_pool().submit(_parse_file, file_path)
+                    except BrokenProcessPool:
+                        # The pool broke after its last use
+                        self._reset_parse_pool()
+                        try:
+                            future = self._get_parse_pool().submit(_parse_file, file_path)
+                        except BrokenProcessPool as e:
+                            remaining.appendleft(file_path)
+                            pool_error = e
+                            break
+                    futures[future] = file_path
+                if not futures:
+                    break
                 
-        return indexable_files
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        # A worker died, failing every file still in the pool
+                        broken.append(file_path)
+                        pool_error = e
+                        continue
+                    except Exception as e:
+                        result = None, None
+                        error = e
+                    else:
+                        error = None
+                    parsed_any = True
+                    yield (file_path, *result, error)
+            
+            if pool_error is None:
+                return
+            broken.extend(remaining)
+            logger.warning(f"Parsing worker died, restarting the pool for {len(broken)} documents")
+            self._reset_parse_pool()
+            if not parsed_any:
+                # Nothing was parsed before the pool broke, so one of these files
+                # likely kills the worker; give up on them rather than retrying forever
+                for file_path in broken:
+                    yield file_path, None, None, pool_error
+                return
+            remaining = deque(broken)
+    
+    def _parse_file(self, file_path: Path) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """Extract a document's text and metadata along with its content hash"""
+        if (file_path.suffix.lower() not in self.PATH_ONLY_EXTENSIONS and
+                file_path.stat().st_size <= self.FUSED_HASH_MAX_SIZE):
+            # Read the file once for both hashing and parsing
+            data = file_path.read_bytes()
+            doc_content = self._process_document(file_path, data)
+            file_hash = content_hasher(data).hexdigest()
+        else:
+            doc_content = self._process_document(file_path)
+            file_hash = self._get_file_hash(file_path) if doc_content else None
+            
+        if not doc_content:
+            return None, None
+        return doc_content, file_hash
+    
+    def _get_parse_pool(self) -> ProcessPoolExecutor:
+        """Get the pool of parsing worker processes, creating it on first use"""
+        with self._lock:
+            if self._parse_pool is None:
+                # Spawn rather than fork: the parent is multithreaded and may have torch loaded
+                self._parse_pool = ProcessPoolExecutor(
+                    max_workers=os.cpu_count(),
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_parse_worker,
+                    initargs=(self.config,)
+                )
+            return self._parse_pool
+    
+    def _reset_parse_pool(self) -> None:
+        """Shut down and drop a broken pool of parsing workers, so the next use starts a new one"""
+        with self._lock:
+            if self._parse_pool is not None:
+                self._parse_pool.shutdown(wait=False, cancel_futures=True)
+                self._parse_pool = None
+    
+    def _get_vector_store(self):
+        """Get the vector store shared by all indexing calls, creating it on first use"""
+        with self._lock:
+            if self._vector_store is None:
+                from vector_store import VectorStore
+                self._vector_store = VectorStore(self.config.vector_db_path,
+                                                 index_type=self.config.index_type)
+            return self._vector_store
+    
+    def _get_indexable_files(self, directory_path: Path, recursive: bool = True) -> List[Path]:
+        """Get all files that can be indexed from the directory"""
+        return list(self._walk_indexable_files(str(directory_path), recursive))
+    
+    def _walk_indexable_files(self, directory: str, recursive: bool) -> Generator[Path, None, None]:
+        """Yield indexable files using os.scandir's cached entry types, without a Path per entry"""
+        subdirectories = []
+        
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif entry.is_file():
+                        name = entry.name
+                        dot = name.rfind('.')
+                        if dot > 0 and name[dot:].lower() in self.supported_extensions:
+                            yield Path(entry.path)
+        except OSError as e:
+            logger.warning(f"Cannot scan folder {directory}: {str(e)}")
+            
+        if recursive:
+            for subdirectory in subdirectories:
+                yield from self._walk_indexable_files(subdirectory, recursive)
     
-    def _needs_indexing(self, file_path: Path, index_metadata: Dict[str, Dict[str, Any]]) -> bool:
+    def _needs_indexing(self, file_path: Path) -> bool:
         """Check if a file needs to be indexed based on modification time and hash"""
         file_str = str(file_path)
-
-        from vector_store import VectorStore
-        vector_store = VectorStore(self.config.vector_db_path)
+        file_metadata = self._get_metadata_db().get(file_str)
         
         # If file is not in metadata, it needs indexing
-        if file_str not in index_metadata:
+        if file_metadata is None:
             logging.info(file_str)
-            logging.info(index_metadata)
             logger.info("File not in metadata needs indexing...")
             return True
-            
+        
         # Check if file has been modified since last indexing
-        last_modified = file_path.stat().st_mtime
-        if last_modified > index_metadata[file_str].get('last_indexed', 0):
+        stat = file_path.stat()
+        last_modified = stat.st_mtime
+        if last_modified > file_metadata.get('last_indexed', 0):
             logger.info("File has been modified needs indexing...")
-            vector_store.remove_document(file_path)
-            vector_store.reload_index()
             return True
+        
+        # Same size and modification time as when indexed, no need to read the file
+        if (stat.st_size == file_metadata.get('size') and
+                abs(last_modified - file_metadata.get('last_indexed_mtime', 0)) < 1e-6):
+            return False
             
         # Check if content has changed using hash
         current_hash = self._get_file_hash(file_path)
-        if current_hash != index_metadata[file_str].get('hash', ''):
+        if current_hash != file_metadata.get('hash', ''):
             logger.info("File contents have changed needs indexing...")
-            vector_store.remove_document(file_path)
-            vector_store.reload_index()
             return True
             
         return False
     
+    def _remove_from_vector_store(self, file_path: Path) -> None:
+        """Remove a document that no longer has any text from the shared vector store"""
+        with self._lock:
+            self._get_vector_store().remove_document(file_path)
+    
     def _get_file_hash(self, file_path: Path) -> str:
         """Calculate a hash of file contents for change detection"""
-        hash_md5 = hashlib.md5()
+        file_hash = content_hasher()
         
-        with open(file_path, "rb") as f:
-            # Read in chunks to avoid memory issues with large files
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
+        # Unbuffered, since reads go straight into our own buffer
+        with open(file_path, "rb", buffering=0) as f:
+            if os.fstat(f.fileno()).st_size > self.HASH_MMAP_THRESHOLD:
+                # Hash large files straight from the page cache in a single call
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    file_hash.update(mm)
+            else:
+                # Read in chunks into one reused buffer rather than a new bytes object per chunk
+                buffer = bytearray(self.HASH_CHUNK_SIZE)
+                view = memoryview(buffer)
+                while True:
+                    size = f.readinto(buffer)
+                    if not size:
+                        break
+                    file_hash.update(view[:size])
                 
-        return hash_md5.hexdigest()
+        return file_hash.hexdigest()
     
-    def _load_index_metadata(self) -> Dict[str, Dict[str, Any]]:
-        """Load metadata about indexed files"""
-        import json
-        
-        metadata_path = Path(self.config.data_dir) / "index_metadata.json"
-        
-        if not metadata_path.exists():
-            return {}
-            
-        try:
-            with open(metadata_path, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading index metadata: {str(e)}")
-            return {}
+    def _get_metadata_db(self) -> _MetadataDB:
+        """Get the database of indexed file metadata, opening it on first use"""
+        with self._metadata_db_lock:
+            if self._metadata_db is None:
+                self._metadata_db = _MetadataDB(Path(self.config.data_dir))
+            return self._metadata_db
     
     def _update_index_metadata(self, file_path: Path, file_hash: str) -> None:
-        """Update metadata for an indexed file"""
-        import json
-        
-        metadata_path = Path(self.config.data_dir) / "index_metadata.json"
-        metadata = self._load_index_metadata()
-        
-        # Update metadata for this file
-        metadata[str(file_path)] = {
-            'last_indexed': time.time(),
-            'hash': file_hash,
-            'size': file_path.stat().st_size
-        }
-        
-        # Ensure data directory exists
-        os.makedirs(Path(self.config.data_dir), exist_ok=True)
-        
-        # Save updated metadata
-        with open(metadata_path, 'w') as f:
-            json.dump(metadata, f, indent=2)
+        """Update metadata for an indexed file (committed when flushed)"""
+        stat = file_path.stat()
+        self._get_metadata_db().upsert(str(file_path), file_hash, stat.st_size, stat.st_mtime)
+    
+    def _flush_metadata(self) -> None:
+        """Commit the metadata updates of the current indexing run"""
+        self._get_metadata_db().commit()
     
-    def _process_document(self, file_path: Path) -> Dict[str, Any]:
-        """Process a document and extract text and metadata"""
+    def _process_document(self, file_path: Path, data: Optional[bytes] = None) -> Dict[str, Any]:
+        """Process a document (from its already read contents, if given) and extract text and metadata"""
         extension = file_path.suffix.lower()
         
         if extension not in self.supported_extensions:
             raise ValueError(f"Unsupported file type: {extension}")
             
         processor_func = self.supported_extensions[extension]
-        text_content = processor_func(file_path)
+        text_content = processor_func(file_path, data)
         
         if not text_content:
             logger.warning(f"No content extracted from {file_path}")
             return None
             
+        # Split into the chunks that get embedded, without keeping the full text around
+        chunks = list(chunk_text_strings(text_content, self.config.chunk_size, self.config.chunk_overlap))
+            
         # Create document record
+        stat = file_path.stat()
         document = {
             'path': str(file_path),
             'filename': file_path.name,
             'extension': extension,
-            'content': text_content,
-            'last_modified': file_path.stat().st_mtime,
-            'size': file_path.stat().st_size
+            'chunks': chunks,
+            'last_modified': stat.st_mtime,
+            'size': stat.st_size
         }
         
         return document
     
-    def _process_pdf(self, file_path: Path) -> str:
-        """Extract text from a PDF file"""
+    def _process_pdf(self, file_path: Path, data: Optional[bytes] = None) -> str:
+        """Extract text from a PDF file, trying each available extractor in turn"""
+        error = None
+        
+        for extractor in self._pdf_extractors:
+            try:
+                return extractor(file_path, data)
+            except Exception as e:
+                logger.warning(f"{extractor.__name__} failed on {file_path}: {str(e)}")
+                error = e
+        
+        logger.error(f"Error reading PDF {file_path}: {str(error)}")
+        raise ValueError(f"PDF parsing error: {str(error)}")
+    
+    def _process_pdf_mupdf(self, file_path: Path, data: Optional[bytes] = None) -> str:
+        """Extract text from a PDF file using PyMuPDF"""
+        if data is None:
+            doc = fitz.open(str(file_path))
+        else:
+            doc = fitz.open(stream=data, filetype='pdf')
+            
+        with doc:
+            page_count = doc.page_count
+            
+            # Inside a parsing worker the other workers already keep the cores busy,
+            # and MuPDF is not thread-safe, so large PDFs parsed on their own are
+            # instead split into page ranges over the worker processes
+            if _worker_processor is None and page_count >= self.PDF_PARALLEL_MIN_PAGES:
+                workers = os.cpu_count() or 1
+                step = -(-page_count // workers)
+                pool = self._get_parse_pool()
+                try:
+                    futures = [pool.submit(_extract_pdf_pages, file_path, start, min(start + step, page_count))
+                               for start in range(0, page_count, step)]
+                    return "\n".join(text for future in futures for text in future.result())
+                except BrokenProcessPool:
+                    self._reset_parse_pool()
+                    raise
+                
+            return "\n".join(self._extract_mupdf_pages(doc, 0, page_count))
+    
+    def _extract_mupdf_pages(self, doc: "fitz.Document", start: int, stop: int) -> List[str]:
+        """Extract the text of pages start to stop (exclusive) of an open PyMuPDF document"""
+        skip_scanned = self.config.skip_scanned_pages
         text_content = []
         
-        try:
-            with open(file_path, 'rb') as f:
-                pdf_reader = pypdf.PdfReader(f)
+        for page_num in range(start, stop):
+            page = doc.load_page(page_num)
+            text = page.get_text("text")
+            if not text.strip():
+                continue
                 
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text_content.append(page.extract_text())
-                    
-            return "\n".join(text_content)
+            # Scanned pages only carry stray text next to a huge image stream
+            if (skip_scanned and len(text) < self.SCANNED_PAGE_MAX_TEXT and
+                    page.get_images(full=False) and
+                    len(page.read_contents()) > self.SCANNED_PAGE_CONTENT_BYTES):
+                continue
+                
+            text_content.append(text)
+            
+        return text_content
+    
+    def _process_pdf_pdftotext(self, file_path: Path, data: Optional[bytes] = None) -> str:
+        """Extract text from a PDF file using the poppler pdftotext command"""
+        # Feed already read contents through stdin
+        result = subprocess.run(
+            ['pdftotext', '-' if data is not None else str(file_path), '-'],
+            input=data,
+            capture_output=True,
+            check=True
+        )
+        return result.stdout.decode('utf-8', errors='replace')
+    
+    def _process_pdf_pypdf(self, file_path: Path, data: Optional[bytes] = None) -> str:
+        """Extract text from a PDF file using pypdf"""
+        if data is not None:
+            return self._extract_pypdf_text(pypdf.PdfReader(io.BytesIO(data)))
+            
+        # Memory-map the file so the parser reads straight from the page cache
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return self._extract_pypdf_text(pypdf.PdfReader(mm))
+    
+    def _extract_pypdf_text(self, pdf_reader: pypdf.PdfReader) -> str:
+        """Extract the text of the pages of an open pypdf reader"""
+        skip_scanned = self.config.skip_scanned_pages
+        text_content = []
+        
+        for page in pdf_reader.pages:
+            if skip_scanned and self._is_scanned_page(page):
+                continue
+                
+            text = page.extract_text()
+            if text.strip():
+                text_content.append(text)
+                
+        return "\n".join(text_content)
+    
+    def _is_scanned_page(self, page: pypdf.PageObject) -> bool:
+        """Check whether a pypdf page is a large content stream without any text operators"""
+        contents = page.get_contents()
+        if contents is None:
+            return False
+            
+        data = contents.get_data()
+        return (len(data) > self.SCANNED_PAGE_CONTENT_BYTES and
+                b'Tj' not in data and b'TJ' not in data)
+    
+    def _process_doc(self, file_path: Path, data: Optional[bytes] = None) -> str:
+        """Extract text from a legacy Word document (.doc) with antiword or catdoc"""
+        if not self._doc_converter:
+            # Some .doc files are really .docx documents with the wrong extension
+            return self._process_docx(file_path, data)
+            
+        try:
+            result = subprocess.run(
+                [self._doc_converter, str(file_path)],
+                capture_output=True,
+                check=True
+            )
+            return result.stdout.decode('utf-8', errors='replace')
             
         except Exception as e:
-            logger.error(f"Error reading PDF {file_path}: {str(e)}")
-            raise ValueError(f"PDF parsing error: {str(e)}")
+            logger.error(f"Error reading Word document {file_path}: {str(e)}")
+            raise ValueError(f"Word document parsing error: {str(e)}")
     
-    def _process_docx(self, file_path: Path) -> str:
+    def _process_docx(self, file_path: Path, data: Optional[bytes] = None) -> str:
         """Extract text from a Word document (.docx)"""
         try:
-            doc = docx.Document(file_path)
+            return self._process_docx_fast(file_path, data)
+        except Exception as e:
+            logger.warning(f"Falling back to python-docx for {file_path}: {str(e)}")
+            
+        try:
+            doc = docx.Document(_open_source(file_path, data))
             text_content = []
             
             for para in doc.paragraphs:
@@ -273,41 +774,68 @@ class DocumentProcessor:
             logger.error(f"Error reading Word document {file_path}: {str(e)}")
             raise ValueError(f"Word document parsing error: {str(e)}")
     
-    def _process_excel(self, file_path: Path) -> str:
+    def _process_docx_fast(self, file_path: Path, data: Optional[bytes] = None) -> str:
+        """Extract text from a Word document (.docx) by parsing its XML directly"""
+        with zipfile.ZipFile(_open_source(file_path, data)) as archive, archive.open('word/document.xml') as f:
+            body = etree.parse(f, _DOCX_XML_PARSER).getroot().find(_W_BODY)
+            
+        def paragraph_text(paragraph):
+            return "".join(t.text or "" for t in paragraph.iter(_W_T))
+            
+        text_content = []
+        for element in body:
+            if element.tag == _W_P:
+                text_content.append(paragraph_text(element))
+            elif element.tag == _W_TBL:
+                # One line per table row, cells separated as with python-docx
+                for row in element.iter(_W_TR):
+                    text_content.append(" | ".join(
+                        "\n".join(paragraph_text(p) for p in cell.iter(_W_P))
+                        for cell in row.iterchildren(_W_TC)
+                    ))
+            else:
+                # Content controls and other wrappers around paragraphs
+                text_content.extend(paragraph_text(p) for p in element.iter(_W_P))
+                
+        return "\n".join(text_content)
+    
+    def _process_excel(self, file_path: Path, data: Optional[bytes] = None) -> str:
         """Extract text from an Excel file"""
         try:
-            workbook = load_workbook(filename=file_path, read_only=True, data_only=True)
+            workbook = load_workbook(filename=_open_source(file_path, data), read_only=True, data_only=True)
             text_content = []
             
             for sheet_name in workbook.sheetnames:
                 sheet = workbook[sheet_name]
                 text_content.append(f"Sheet: {sheet_name}")
                 
-                # Process each row
-                for row in sheet.iter_rows():
-                    row_values = [str(cell.value) if cell.value is not None else "" for cell in row]
-                    text_content.append(" | ".join(row_values))
+                # Process each row as plain values, without creating cell objects
+                for row in sheet.iter_rows(values_only=True):
+                    text_content.append(" | ".join("" if value is None else str(value) for value in row))
                     
+            workbook.close()
             return "\n".join(text_content)
             
         except Exception as e:
             logger.error(f"Error reading Excel file {file_path}: {str(e)}")
             raise ValueError(f"Excel parsing error: {str(e)}")
     
-    def _process_csv(self, file_path: Path) -> str:
+    def _process_csv(self, file_path: Path, data: Optional[bytes] = None) -> str:
         """Extract text from a CSV file"""
         try:
-            df = pd.read_csv(file_path)
             text_content = []
             
-            # Add header
-            headers = " | ".join(df.columns.astype(str))
-            text_content.append(headers)
-            
-            # Add rows
-            for _, row in df.iterrows():
-                row_values = " | ".join(row.astype(str))
-                text_content.append(row_values)
+            # Read as strings in chunks so huge files never become one DataFrame
+            with pd.read_csv(_open_source(file_path, data), dtype=str, keep_default_na=False,
+                             chunksize=self.CSV_CHUNK_ROWS) as reader:
+                for df in reader:
+                    # Add header
+                    if not text_content:
+                        text_content.append(" | ".join(df.columns.astype(str)))
+                    
+                    # Add rows, joining whole columns at once rather than row by row
+                    rows = df.iloc[:, 0].str.cat(df.iloc[:, 1:], sep=" | ")
+                    text_content.extend(rows)
                 
             return "\n".join(text_content)
             
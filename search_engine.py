@@ -3,25 +3,81 @@ Search Engine Module
 Handles search queries and result processing for the document search application.
 """
 import os
-import subprocess
-import platform
+import re
+import time
 import logging
-from typing import List, Dict, Any
+import functools
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Iterator, Tuple
+
+import numpy as np
 
 from vector_store import VectorStore
 from ui_manager import UIManager
 from config import ApplicationConfig
+from utils import cosine_topk, open_with_default_app
 
 logger = logging.getLogger("semantic_search")
 
+# File type terms that may appear anywhere in a query, grouped by category. The
+# lookahead makes finditer report overlapping terms too, so one scan finds them all
+_QUERY_TERMS_RE = re.compile(
+    r'(?=(?P<spreadsheet>excel|spreadsheet|sheet|xlsx|csv)'
+    r'|(?P<document>word|document|doc|docx)'
+    r'|(?P<pdf>pdf))',
+    re.IGNORECASE
+)
+
+# Text appended to queries of each category, in order of precedence
+_QUERY_SUFFIXES = (
+    # Excel/spreadsheet: prioritize numerical content
+    ('spreadsheet', "spreadsheet data columns rows"),
+    # Word/document: prioritize text content
+    ('document', "document text paragraphs"),
+    # PDF: prioritize formatted content
+    ('pdf', "pdf document pages"),
+)
+
 class SearchEngine:
     """Class to handle semantic search functionality"""
     
+    # Query cache settings
+    QUERY_EMBEDDING_CACHE_SIZE = 1024
+    SEMANTIC_CACHE_SIZE = 1024
+    SEMANTIC_CACHE_THRESHOLD = 0.97
+    
+    # Seconds a file existence check is reused for, and the most checks kept
+    EXISTS_CACHE_TTL = 30.0
+    EXISTS_CACHE_SIZE = 4096
+    
     def __init__(self, vector_store: VectorStore, ui_manager: UIManager, config: ApplicationConfig):
         """Initialize the search engine"""
         self.vector_store = vector_store
         self.ui_manager = ui_manager
         self.config = config
+        
+        # Exact-match tier: query embeddings keyed on the normalized query string
+        self._embed_query = functools.lru_cache(maxsize=self.QUERY_EMBEDDING_CACHE_SIZE)(
+            self.vector_store.embed_query
+        )
+        
+        # Semantic tier: (limit, results) entries with their unit query embeddings as
+        # rows of one preallocated matrix, so a lookup is a single matrix-vector
+        # product; the least recently used row is overwritten once the cache is full
+        self._semantic_entries: List[Tuple[int, List[Dict[str, Any]]]] = []
+        self._semantic_matrix = np.empty((self.SEMANTIC_CACHE_SIZE, self.vector_store.embedding_dim),
+                                         dtype='float32')
+        self._semantic_last_used = np.zeros(self.SEMANTIC_CACHE_SIZE, dtype=np.int64)
+        self._semantic_clock = 0
+        self._semantic_generation = self.vector_store.generation
+        self._semantic_lock = threading.Lock()
+        
+        # Recent file existence checks: path -> (time checked, exists), least
+        # recently used first. Cleared whenever the index changes
+        self._exists_cache: OrderedDict[str, Tuple[float, bool]] = OrderedDict()
+        self._exists_generation = self.vector_store.generation
+        self._exists_lock = threading.Lock()
     
     def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
         """
@@ -34,22 +90,118 @@ class SearchEngine:
         Returns:
             List of search results with metadata
         """
+        return list(self.search_stream(query, limit=limit))
+    
+    def search_stream(self, query: str, limit: int = 5) -> Iterator[Dict[str, Any]]:
+        """
+        Search for documents matching the query, yielding each result as soon as
+        it has been validated
+        
+        Args:
+            query: Natural language search query
+            limit: Maximum number of results to return
+            
+        Yields:
+            Search results with metadata, most similar first
+        """
         # Enhance query if needed (e.g., add synonyms, handle specific file types)
         enhanced_query = self._enhance_query(query)
         
-        # Execute search using vector store
-        results = self.vector_store.search(enhanced_query, limit=limit)
+        # Execute search using vector store, reusing cached results where possible
+        results = self._cached_search(enhanced_query, limit)
         
         # Validate results (ensure files still exist)
-        validated_results = []
         for result in results:
             file_path = result.get('path')
-            if os.path.exists(file_path):
-                validated_results.append(result)
+            if self._exists(file_path):
+                yield result
             else:
                 logger.warning(f"File no longer exists: {file_path}")
+    
+    def _exists(self, file_path: str) -> bool:
+        """
+        Check whether a file exists, reusing checks made in the last EXISTS_CACHE_TTL seconds
+        
+        Args:
+            file_path: Path to check
+            
+        Returns:
+            True if the file exists
+        """
+        now = time.monotonic()
+        with self._exists_lock:
+            # Documents added or removed since may have been the ones checked
+            if self._exists_generation != self.vector_store.generation:
+                self._exists_cache.clear()
+                self._exists_generation = self.vector_store.generation
+            
+            cached = self._exists_cache.get(file_path)
+            if cached is not None and now - cached[0] < self.EXISTS_CACHE_TTL:
+                self._exists_cache.move_to_end(file_path)
+                return cached[1]
         
-        return validated_results
+        # A single lstat, without following symlinks
+        try:
+            os.lstat(file_path)
+            exists = True
+        except OSError:
+            exists = False
+        
+        with self._exists_lock:
+            self._exists_cache[file_path] = (now, exists)
+            self._exists_cache.move_to_end(file_path)
+            if len(self._exists_cache) > self.EXISTS_CACHE_SIZE:
+                self._exists_cache.popitem(last=False)
+        return exists
+    
+    def _cached_search(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        Search the vector store through the exact-match and semantic query caches
+        
+        Args:
+            query: Search query
+            limit: Maximum number of results to return
+            
+        Returns:
+            List of search results with metadata
+        """
+        query_embedding = self._embed_query(query.strip().lower())
+        norm = np.linalg.norm(query_embedding)
+        unit_embedding = query_embedding / norm if norm > 0 else query_embedding
+        
+        with self._semantic_lock:
+            # Cached results are only valid for the index contents they were computed on
+            if self._semantic_generation != self.vector_store.generation:
+                self._semantic_entries.clear()
+                self._semantic_generation = self.vector_store.generation
+            
+            self._semantic_clock += 1
+            count = len(self._semantic_entries)
+            if count:
+                indices, similarities = cosine_topk(unit_embedding, self._semantic_matrix[:count], 1)
+                row = int(indices[0])
+                cached_limit, cached_results = self._semantic_entries[row]
+                if similarities[0] >= self.SEMANTIC_CACHE_THRESHOLD and cached_limit >= limit:
+                    logger.debug("Semantic cache hit for query: %s", query)
+                    self._semantic_last_used[row] = self._semantic_clock
+                    return cached_results[:limit]
+            generation = self._semantic_generation
+        
+        results = self.vector_store.search_by_embedding(query_embedding, limit=limit)
+        
+        with self._semantic_lock:
+            if generation == self._semantic_generation:
+                count = len(self._semantic_entries)
+                if count < self.SEMANTIC_CACHE_SIZE:
+                    row = count
+                    self._semantic_entries.append((limit, results))
+                else:
+                    row = int(np.argmin(self._semantic_last_used))
+                    self._semantic_entries[row] = (limit, results)
+                self._semantic_matrix[row] = unit_embedding
+                self._semantic_last_used[row] = self._semantic_clock
+        
+        return results
     
     def open_document(self, document: Dict[str, Any]) -> bool:
         """
@@ -68,12 +220,7 @@ class SearchEngine:
         
         try:
             # Open the file with the default application
-            if platform.system() == 'Windows':
-                os.startfile(file_path)
-            elif platform.system() == 'Darwin':  # macOS
-                subprocess.run(['open', file_path], check=True)
-            else:  # Linux
-                subprocess.run(['xdg-open', file_path], check=True)
+            open_with_default_app(file_path)
                 
             logger.info(f"Opened document: {file_path}")
             return True
@@ -93,19 +240,13 @@ class SearchEngine:
         Returns:
             Enhanced query
         """
-        # If query specifically mentions a file type, we could boost certain aspects
-        enhanced_query = query
+        # If query specifically mentions a file type, boost certain aspects
+        categories = {match.lastgroup for match in _QUERY_TERMS_RE.finditer(query)}
+        if not categories:
+            return query
         
-        # Example: If query mentions Excel/spreadsheet, prioritize numerical content
-        if any(term in query.lower() for term in ['excel', 'spreadsheet', 'sheet', 'xlsx', 'csv']):
-            enhanced_query = f"{query} spreadsheet data columns rows"
-            
-        # If query mentions Word/document, prioritize text content
-        elif any(term in query.lower() for term in ['word', 'document', 'doc', 'docx']):
-            enhanced_query = f"{query} document text paragraphs"
-            
-        # If query mentions PDF, prioritize formatted content
-        elif any(term in query.lower() for term in ['pdf']):
-            enhanced_query = f"{query} pdf document pages"
+        for category, suffix in _QUERY_SUFFIXES:
+            if category in categories:
+                return f"{query} {suffix}"
             
-        return enhanced_query
+        return query
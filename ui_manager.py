@@ -3,7 +3,7 @@ UI Manager Module
 Handles user interface display and formatting for the document search application.
 """
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from rich.console import Console
 from rich.panel import Panel
 from rich.table import Table
@@ -25,6 +25,17 @@ class UIManager:
         'accent': '#C4314B'       # Attention red
     }
     
+    # Descriptions of the configuration settings
+    CONFIG_DESCRIPTIONS = {
+        'data_dir': "Directory for storing application data",
+        'vector_db_path': "Path to the vector database",
+        'embedding_model': "Model used for generating embeddings",
+        'chunk_size': "Size of text chunks for indexing",
+        'chunk_overlap': "Overlap between text chunks",
+        'index_type': "Vector index type (flat, fp16, sq8, hnsw, ivf, pq, pca)",
+        'skip_scanned_pages': "Skip image-only (scanned) PDF pages"
+    }
+    
     def __init__(self, console: Optional[Console] = None):
         """Initialize the UI manager"""
         # Define theme with the specified colors
@@ -42,10 +53,20 @@ class UIManager:
         
         # Initialize console with theme
         self.console = console or Console(theme=self.theme)
+        
+        # Styles parsed once, rather than from a style string on every render
+        self._style_primary = Style(color=self.COLORS['primary'])
+        self._style_primary_bold = Style(color=self.COLORS['primary'], bold=True)
+        self._style_secondary = Style(color=self.COLORS['secondary'])
+        self._style_text = Style(color=self.COLORS['text'])
+        self._style_dim = Style(dim=True)
+        self._style_success = Style(color=self.COLORS['secondary'], bold=True)
+        self._style_error = Style(color=self.COLORS['accent'], bold=True)
+        self._style_warning = Style(color="yellow", bold=True)
     
     def display_welcome(self) -> None:
         """Display welcome message"""
-        title = Text("Semantic Document Search", style=f"bold {self.COLORS['primary']}")
+        title = Text("Semantic Document Search", style=self._style_primary_bold)
         
         panel = Panel(
             Text.from_markup(
@@ -56,7 +77,7 @@ class UIManager:
                 "Type [bold]--help[/] after any command for more information"
             ),
             title=title,
-            border_style=self.COLORS['primary'],
+            border_style=self._style_primary,
             box=ROUNDED
         )
         
@@ -69,13 +90,13 @@ class UIManager:
         table = Table(
             title="Available Commands",
             box=ROUNDED,
-            border_style=self.COLORS['primary'],
-            title_style=f"bold {self.COLORS['primary']}"
+            border_style=self._style_primary,
+            title_style=self._style_primary_bold
         )
         
-        table.add_column("Command", style=f"bold {self.COLORS['primary']}")
-        table.add_column("Description", style=self.COLORS['text'])
-        table.add_column("Example", style="dim")
+        table.add_column("Command", style=self._style_primary_bold)
+        table.add_column("Description", style=self._style_text)
+        table.add_column("Example", style=self._style_dim)
         
         table.add_row(
             "index <directory>", 
@@ -113,41 +134,19 @@ class UIManager:
         table = Table(
             title=f"Search Results for: '{query}'",
             box=ROUNDED,
-            border_style=self.COLORS['primary'],
-            title_style=f"bold {self.COLORS['primary']}"
+            border_style=self._style_primary,
+            title_style=self._style_primary_bold
         )
         
-        table.add_column("#", style="dim", width=3)
-        table.add_column("Filename", style=f"bold {self.COLORS['primary']}")
-        table.add_column("Path", style=self.COLORS['text'])
-        table.add_column("Relevance", style=self.COLORS['secondary'], width=10)
-        table.add_column("Preview", style="dim")
+        table.add_column("#", style=self._style_dim, width=3)
+        table.add_column("Filename", style=self._style_primary_bold)
+        table.add_column("Path", style=self._style_text)
+        table.add_column("Relevance", style=self._style_secondary, width=10)
+        table.add_column("Preview", style=self._style_dim)
         
         # Add rows for each result
-        for i, result in enumerate(results, 1):
-            # Format the relevance score as a percentage
-            relevance = f"{result.get('similarity', 0) * 100:.1f}%"
-            
-            # Get the preview or snippet
-            preview = result.get('content_preview', '')
-            if len(preview) > 60:
-                preview = preview[:57] + "..."
-            
-            # Get the path and format it for display
-            path = result.get('path', '')
-            if len(path) > 40:
-                # Show only the first and last parts of the path
-                parts = path.split(os.sep)
-                if len(parts) > 3:
-                    path = os.sep.join([parts[0], "...", parts[-2], parts[-1]])
-            
-            table.add_row(
-                str(i),
-                result.get('filename', ''),
-                path,
-                relevance,
-                preview
-            )
+        for row in [self._format_result_row(i, result) for i, result in enumerate(results, 1)]:
+            table.add_row(*row)
         
         # Add instructions footer
         table.caption = "To open a document, use: search <query> --open"
@@ -156,23 +155,43 @@ class UIManager:
         self.console.print(table)
         self.console.print()
     
+    def _format_result_row(self, index: int, result: Dict[str, Any]) -> Tuple[str, str, str, str, str]:
+        """Format the cells of a search results table row"""
+        path = result.get('path', '')
+        preview = result.get('content_preview', '')
+        
+        # Format the relevance score as a percentage
+        relevance = f"{result.get('similarity', 0) * 100:.1f}%"
+        
+        # Get the preview or snippet
+        if len(preview) > 60:
+            preview = preview[:57] + "..."
+        
+        # Show only the first and last parts of long paths
+        if len(path) > 40:
+            parts = path.split(os.sep)
+            if len(parts) > 3:
+                path = os.sep.join([parts[0], "...", parts[-2], parts[-1]])
+        
+        return str(index), result.get('filename', ''), path, relevance, preview
+    
     def display_message(self, message: str) -> None:
         """Display a simple message"""
         self.console.print(f"  {message}")
     
     def display_success(self, message: str) -> None:
         """Display a success message"""
-        text = Text(f"✓ {message}", style=f"bold {self.COLORS['secondary']}")
+        text = Text(f"✓ {message}", style=self._style_success)
         self.console.print(text)
     
     def display_error(self, message: str) -> None:
         """Display an error message"""
-        text = Text(f"✗ {message}", style=f"bold {self.COLORS['accent']}")
+        text = Text(f"✗ {message}", style=self._style_error)
         self.console.print(text)
     
     def display_warning(self, message: str) -> None:
         """Display a warning message"""
-        text = Text(f"⚠ {message}", style="bold yellow")
+        text = Text(f"⚠ {message}", style=self._style_warning)
         self.console.print(text)
     
     def display_config(self, config_dict: Dict[str, Any]) -> None:
@@ -180,25 +199,17 @@ class UIManager:
         table = Table(
             title="Current Configuration",
             box=ROUNDED,
-            border_style=self.COLORS['primary'],
-            title_style=f"bold {self.COLORS['primary']}"
+            border_style=self._style_primary,
+            title_style=self._style_primary_bold
         )
         
-        table.add_column("Setting", style=f"bold {self.COLORS['primary']}")
-        table.add_column("Value", style=self.COLORS['text'])
-        table.add_column("Description", style="dim")
+        table.add_column("Setting", style=self._style_primary_bold)
+        table.add_column("Value", style=self._style_text)
+        table.add_column("Description", style=self._style_dim)
         
         # Add rows for each configuration setting
         for key, value in config_dict.items():
-            description = {
-                'data_dir': "Directory for storing application data",
-                'vector_db_path': "Path to the vector database",
-                'embedding_model': "Model used for generating embeddings",
-                'chunk_size': "Size of text chunks for indexing",
-                'chunk_overlap': "Overlap between text chunks"
-            }.get(key, "")
-            
-            table.add_row(key, str(value), description)
+            table.add_row(key, str(value), self.CONFIG_DESCRIPTIONS.get(key, ""))
         
         self.console.print()
         self.console.print(table)
@@ -3,11 +3,29 @@ Utilities Module
 Helper functions for the document search application.
 """
 import os
+import re
+import json
+import hashlib
 import platform
+import subprocess
 import tempfile
 import logging
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Any, Iterator, Tuple
+
+import numpy as np
+
+try:
+    # BLAKE3 hashes with SIMD, several times faster than hashlib
+    from blake3 import blake3 as content_hasher
+except ImportError:
+    content_hasher = hashlib.blake2b
+
+try:
+    import orjson
+except ImportError:
+    # Fall back to the standard library serializer
+    orjson = None
 
 logger = logging.getLogger("semantic_search")
 
@@ -55,6 +73,177 @@ def get_temp_dir() -> Path:
     os.makedirs(temp_dir, exist_ok=True)
     return Path(temp_dir)
 
+def json_loads(data: bytes) -> Any:
+    """
+    Parse JSON data, using orjson when it is installed
+    
+    Args:
+        data: JSON document as bytes or str
+        
+    Returns:
+        Parsed Python object
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj: Any, indent: bool = False) -> bytes:
+    """
+    Serialize an object to JSON bytes, using orjson when it is installed
+    
+    Args:
+        obj: Object to serialize
+        indent: Whether to pretty-print with two-space indentation
+        
+    Returns:
+        UTF-8 encoded JSON document
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode('utf-8')
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Find the k highest scores along the last axis
+    
+    Args:
+        scores: Scores of shape (n,), or (m, n) for one row of scores per query
+        k: Number of scores to keep, at most n
+        
+    Returns:
+        Indices into the last axis, highest score first
+    """
+    n = scores.shape[-1]
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    
+    # Select the top k in linear time, then sort only those
+    if k < n:
+        top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    else:
+        top = np.broadcast_to(np.arange(n), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1)
+    return np.take_along_axis(top, order, axis=-1)
+
+def cosine_topk(query_vec: np.ndarray, corpus: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the corpus rows most similar to a query vector, or to each of several
+    
+    Both inputs should be L2-normalized so the dot product is the cosine
+    similarity. Keeping the corpus a single C-contiguous float32 matrix makes
+    the scoring one BLAS matrix product instead of a Python loop.
+    
+    Args:
+        query_vec: Query vector of shape (d,), or queries of shape (m, d)
+        corpus: Matrix of shape (n, d)
+        k: Number of rows to return
+        
+    Returns:
+        Tuple of (row indices, similarity scores), highest score first; with
+        several queries, one row of each per query
+    """
+    corpus = np.ascontiguousarray(corpus, dtype=np.float32)
+    scores = np.asarray(query_vec, dtype=np.float32) @ corpus.T
+    
+    top = top_k_indices(scores, min(k, corpus.shape[0]))
+    return top, np.take_along_axis(scores, top, axis=-1)
+
+def _mmr_select(candidates: np.ndarray, relevance: np.ndarray, k: int, lambda_: float) -> np.ndarray:
+    """Greedily pick k candidate rows by maximal marginal relevance"""
+    n = candidates.shape[0]
+    selected = np.empty(k, dtype=np.int64)
+    taken = np.zeros(n, dtype=np.bool_)
+    # Highest similarity of each candidate to any selected one, updated after each pick
+    redundancy = np.full(n, -np.inf, dtype=np.float32)
+    
+    for step in range(k):
+        scores = np.full(n, -np.inf, dtype=np.float32)
+        for j in range(n):
+            if not taken[j]:
+                penalty = redundancy[j] if step > 0 else 0.0
+                scores[j] = lambda_ * relevance[j] - (1.0 - lambda_) * penalty
+        best = np.argmax(scores)
+        selected[step] = best
+        taken[best] = True
+        
+        for j in range(n):
+            if not taken[j]:
+                similarity = 0.0
+                for i in range(candidates.shape[1]):
+                    similarity += candidates[j, i] * candidates[best, i]
+                if similarity > redundancy[j]:
+                    redundancy[j] = similarity
+    
+    return selected
+
+# MMR kernel, compiled with numba on first use when it is installed
+_mmr_kernel = None
+
+def _get_mmr_kernel():
+    """Get the MMR kernel, importing numba and compiling it on the first call"""
+    global _mmr_kernel
+    if _mmr_kernel is None:
+        try:
+            from numba import njit
+            _mmr_kernel = njit(cache=True)(_mmr_select)
+        except ImportError:
+            # Fall back to running the kernel as plain Python
+            _mmr_kernel = _mmr_select
+    return _mmr_kernel
+
+def mmr_rerank(query_vec: np.ndarray, candidates: np.ndarray, k: int, lambda_: float = 0.5) -> np.ndarray:
+    """
+    Reorder search candidates by maximal marginal relevance, trading similarity
+    to the query against similarity to the candidates already picked
+    
+    Both inputs should be L2-normalized, as for cosine_topk.
+    
+    Args:
+        query_vec: Query vector of shape (d,)
+        candidates: Candidate vectors of shape (n, d)
+        k: Number of candidates to pick
+        lambda_: Weight of query similarity; 1.0 keeps the plain similarity order
+        
+    Returns:
+        Indices of the picked candidate rows, in pick order
+    """
+    candidates = np.ascontiguousarray(candidates, dtype=np.float32)
+    relevance = candidates @ np.asarray(query_vec, dtype=np.float32)
+    k = min(k, len(candidates))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    return _get_mmr_kernel()(candidates, relevance, k, np.float32(lambda_))
+
+# (divisor, unit name) for each power of 1024, indexed by bit length // 10
+SIZE_UNITS = ((1, 'bytes'), (1024, 'KB'), (1024 ** 2, 'MB'), (1024 ** 3, 'GB'))
+
+# Command that opens a path with the default application (None on Windows,
+# which uses os.startfile instead)
+_OPENER = {'Windows': None, 'Darwin': 'open'}.get(platform.system(), 'xdg-open')
+
+def open_with_default_app(path: str) -> None:
+    """
+    Open a file or folder with the system's default application
+    
+    The opener is started as a detached process and not waited for, so the
+    caller returns as soon as it has been spawned.
+    
+    Args:
+        path: Path to the file or folder
+    """
+    if _OPENER is None:
+        os.startfile(path)
+        return
+    
+    subprocess.Popen(
+        [_OPENER, path],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=True,
+        start_new_session=True
+    )
+
 def format_file_size(size_bytes: int) -> str:
     """
     Format file size from bytes to a human-readable format
@@ -65,14 +254,12 @@ def format_file_size(size_bytes: int) -> str:
     Returns:
         Formatted file size string
     """
-    if size_bytes < 1024:
+    # Every 10 bits of magnitude is one step up the unit table
+    unit_index = min((max(int(size_bytes), 1).bit_length() - 1) // 10, len(SIZE_UNITS) - 1)
+    if unit_index == 0:
         return f"{size_bytes} bytes"
-    elif size_bytes < 1024 * 1024:
-        return f"{size_bytes / 1024:.1f} KB"
-    elif size_bytes < 1024 * 1024 * 1024:
-        return f"{size_bytes / (1024 * 1024):.1f} MB"
-    else:
-        return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
+    divisor, unit = SIZE_UNITS[unit_index]
+    return f"{size_bytes / divisor:.1f} {unit}"
 
 def get_file_extension(file_path: str) -> str:
     """
@@ -101,22 +288,24 @@ def is_supported_file(file_path: str) -> bool:
     }
     return get_file_extension(file_path) in supported_extensions
 
-def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> List[str]:
+# Sentence-ending punctuation followed by whitespace
+_SENTENCE_END_RE = re.compile(r'[.!?]\s')
+
+def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> Iterator[Tuple[int, int]]:
     """
-    Split text into overlapping chunks for processing
+    Split text into overlapping chunks for processing, without copying it
     
     Args:
         text: The text to split
         chunk_size: Maximum size of each chunk
         chunk_overlap: Overlap between chunks
         
-    Returns:
-        List of text chunks
+    Yields:
+        (start, end) offsets of each chunk in the text
     """
     if not text or chunk_size <= 0:
-        return []
+        return
         
-    chunks = []
     start = 0
     
     while start < len(text):
@@ -125,16 +314,30 @@ def chunk_text(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> L
         
         # Try to end at a sentence boundary
         if end < len(text):
-            # Look for sentence ending punctuation followed by space or newline
-            for i in range(end - 1, max(start, end - 100), -1):
-                if text[i] in '.!?' and (i + 1 == len(text) or text[i + 1].isspace()):
-                    end = i + 1
-                    break
+            # Look for the last sentence ending punctuation followed by space or
+            # newline within the final 100 characters
+            match = None
+            for match in _SENTENCE_END_RE.finditer(text, max(start, end - 100) + 1, end + 1):
+                pass
+            if match:
+                end = match.start() + 1
         
-        # Add the chunk
-        chunks.append(text[start:end])
+        yield start, end
         
-        # Move to next chunk with overlap
-        start = end - chunk_overlap if end < len(text) else end
+        # Move to next chunk with overlap, always moving forward
+        start = max(end - chunk_overlap, start + 1) if end < len(text) else end
+
+def chunk_text_strings(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> Iterator[str]:
+    """
+    Split text into overlapping chunks for processing
     
-    return chunks
+    Args:
+        text: The text to split
+        chunk_size: Maximum size of each chunk
+        chunk_overlap: Overlap between chunks
+        
+    Yields:
+        Text of each chunk
+    """
+    for start, end in chunk_text(text, chunk_size, chunk_overlap):
+        yield text[start:end]
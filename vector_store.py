@@ -3,13 +3,23 @@ Vector Store Module
 Manages the FAISS vector database for storing and retrieving document embeddings.
 """
 import os
-import json
+import atexit
 import logging
+import sqlite3
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 
 import faiss
+import torch
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
 import compat_hf
 import huggingface_hub
 
@@ -17,16 +27,98 @@ import huggingface_hub
 huggingface_hub.cached_download = compat_hf.cached_download
 from sentence_transformers import SentenceTransformer
 
+from config import INDEX_TYPES
+from utils import content_hasher, cosine_topk, json_loads, json_dumps, mmr_rerank, top_k_indices
+
 logger = logging.getLogger("semantic_search")
 
 class VectorStore:
     """Class to manage the vector database for document embeddings"""
     
-    def __init__(self, db_path: str):
-        """Initialize the vector store with the path to the database"""
+    # Supported index types: exact FP32 vectors, FP16 vectors, 8-bit scalar-quantized
+    # vectors, an HNSW graph (over FP16 vectors) for approximate search in O(log N),
+    # inverted lists that only scan the clusters closest to the query,
+    # product-quantized vectors, or vectors reduced in dimension by PCA
+    INDEX_TYPES = INDEX_TYPES
+    
+    # Index types that must be trained on indexed vectors; until enough have been
+    # added, vectors are kept in a flat index
+    TRAINED_INDEX_TYPES = ('ivf', 'pq', 'pca')
+    
+    # HNSW graph parameters; searches explore at least HNSW_EF_SEARCH candidates
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 80
+    HNSW_EF_SEARCH = 32
+    
+    # IVF parameters. Vectors are kept in a flat index until there are enough to
+    # train 4 * sqrt(N) clusters (about 39 training points per cluster)
+    IVF_TRAIN_MIN_VECTORS = 25_000
+    IVF_NPROBE = 8
+    
+    # PQ parameters. Each vector is stored as PQ_M one-byte codes (48 bytes instead
+    # of 1536 at d=384), once there are enough vectors to train the 256-entry
+    # codebooks (about 39 training points per entry)
+    PQ_M = 48
+    PQ_NBITS = 8
+    PQ_TRAIN_MIN_VECTORS = 10_000
+    
+    # PCA parameters. Vectors are projected to PCA_DIM dimensions, cutting index
+    # size and distance computations 3x at d=384
+    PCA_DIM = 128
+    PCA_TRAIN_MIN_VECTORS = 2048
+    
+    # Documents are stored as several chunks, so searches fetch this many
+    # neighbours per requested result before keeping each document's best chunk
+    SEARCH_OVERFETCH = 4
+    
+    # Up to this many chunks, searches of flat and fp16 indexes score the stored
+    # embeddings with a matrix product, which beats the FAISS index at this size.
+    # Other index types are always searched through FAISS. The stored embeddings
+    # are widened to FP32 this many rows at a time
+    BRUTE_FORCE_MAX_VECTORS = 50_000
+    BRUTE_FORCE_INDEX_TYPES = ('flat', 'fp16')
+    BRUTE_FORCE_BLOCK_ROWS = 8192
+    
+    # Token length limits of the buckets texts are grouped into before encoding, so
+    # each forward pass pads its texts to a similar length
+    LENGTH_BUCKETS = (32, 64, 128)
+    
+    # ONNX exports of the model, relative to the model directory, tried in order when
+    # running on CPU with onnxruntime installed. The int8 model is produced once with
+    # `optimum-cli export onnx` followed by `optimum-cli onnxruntime quantize --avx512_vnni`
+    ONNX_MODEL_FILES = ('onnx/model_qint8_avx512_vnni.onnx', 'onnx/model.onnx')
+    
+    # Changes (adds or removals) between full saves of the index. In between, new
+    # embeddings are appended to a staging file and merged into the index on load
+    INDEX_SAVE_INTERVAL = 32
+    
+    # Characters of each chunk kept as its preview in the metadata
+    PREVIEW_LENGTH = 200
+    
+    # Texts embedded per pipeline step in add_documents; each step's embeddings are
+    # added to the index while the next step is being embedded
+    ADD_PIPELINE_TEXTS = 256
+    
+    def __init__(self, db_path: str, index_type: str = 'flat'):
+        """
+        Initialize the vector store with the path to the database
+        
+        Args:
+            db_path: Directory holding the index and metadata files
+            index_type: Type of index to create when none exists yet (see INDEX_TYPES)
+        """
+        if index_type not in self.INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {index_type}")
+        
         self.db_path = Path(db_path)
+        self.index_type = index_type
         self.index_path = self.db_path / "faiss_index.bin"
         self.metadata_path = self.db_path / "document_metadata.json"
+        self.metadata_db_path = self.db_path / "document_metadata.sqlite"
+        self.embeddings_path = self.db_path / "embeddings.npy"
+        self.embeddings_work_path = self.db_path / "embeddings.work.npy"
+        self.embedding_ids_path = self.db_path / "embedding_ids.npy"
+        self.staging_path = self.db_path / "staged_embeddings.bin"
         
         # Create the database directory if it doesn't exist
         os.makedirs(self.db_path, exist_ok=True)
@@ -34,69 +126,257 @@ class VectorStore:
         # Initialize the embedding model
         local_model_path = "./all-MiniLM-L6-v2"
 
-        self.model = SentenceTransformer(local_model_path)
+        # Run the model in half precision on a GPU when one is available
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.model = SentenceTransformer(local_model_path, device=self.device)
+        if self.device == 'cuda':
+            self.model.half()
+        self.model.eval()
         self.embedding_dim = self.model.get_sentence_embedding_dimension()
         
+        # Raw embeddings are kept in FP32 for flat indexes and in half precision for
+        # every other type, which stores or trains on reduced-precision vectors anyway
+        self._embedding_dtype = np.dtype('float32' if index_type == 'flat' else 'float16')
+        
+        # Record layout of the staging file: a chunk id followed by its embedding
+        self._staging_dtype = np.dtype([('id', '<i8'), ('embedding', '<f4', (self.embedding_dim,))])
+        
+        # On CPU, encode with ONNX Runtime when an exported model is available
+        self._onnx_session = None
+        if self.device == 'cpu':
+            self._onnx_session = self._load_onnx_session(Path(local_model_path))
+        
         # Initialize FAISS index
         self.index = None
         self.document_metadata = {}
         
+        # The same metadata keyed by integer id, so search results are looked up
+        # directly by the labels FAISS returns
+        self._metadata_by_id = {}
+        
+        # Raw embedding and id of every indexed chunk, so the index can be rebuilt
+        # without re-embedding. Embeddings added since they were last needed are
+        # kept in separate blocks rather than copying the whole matrix on every add
+        self._embeddings = None
+        self._embedding_ids = None
+        self._added_embeddings = []
+        self._added_ids = []
+        
+        # Number of changes since the index was last saved in full
+        self._unsaved_changes = 0
+        
+        # Whether the index is an IVF index memory-mapped read-only from its file
+        self._index_mapped = False
+        
+        # Id given to the next chunk added. Ids are never reused while their
+        # chunk is indexed, so they stay valid across removals
+        self._next_id = 0
+        
+        # Paths of all indexed documents, for constant-time membership checks
+        self.document_paths = set()
+        
+        # Content hash of each indexed document, to skip re-adding unchanged documents
+        self._path_to_hash = {}
+        
+        # Incremented whenever the index contents change, so callers can invalidate caches
+        self.generation = 0
+        
+        # Guards the index and metadata, which are shared by search and indexing threads
+        self._lock = threading.RLock()
+        
+        # Chunk metadata is stored in SQLite, so each change writes only its own rows
+        self._metadata_db = sqlite3.connect(str(self.metadata_db_path), check_same_thread=False)
+        self._metadata_db.execute("PRAGMA journal_mode=WAL")
+        self._metadata_db.execute("PRAGMA synchronous=NORMAL")
+        self._metadata_db.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "id INTEGER PRIMARY KEY, path TEXT NOT NULL, preview TEXT, json BLOB NOT NULL)"
+        )
+        self._metadata_db.execute("CREATE INDEX IF NOT EXISTS docs_path ON docs (path)")
+        self._metadata_db.execute(
+            "CREATE TABLE IF NOT EXISTS documents (path TEXT PRIMARY KEY, hash TEXT NOT NULL)"
+        )
+        self._metadata_db.commit()
+        
         # Load existing index if available
         self._load_index()
+        
+        # Save changes not yet written in full when the application exits
+        atexit.register(self.flush)
     
     def is_initialized(self) -> bool:
         """Check if the vector store has been initialized with documents"""
         return self.index is not None and len(self.document_metadata) > 0
     
     def reload_index(self):
-        return self._load_index()
+        with self._lock:
+            return self._load_index()
     
-    def add_documents(self, documents: List[Dict[str, Any]]) -> None:
+    def flush(self) -> None:
+        """Save the index in full if it changed since it was last saved"""
+        with self._lock:
+            if self._unsaved_changes:
+                self._save_index()
+    
+    def add_documents(self, documents: List[Dict[str, Any]], batch_size: int = 32) -> None:
         """
-        Add documents to the vector store
+        Add documents to the vector store, one vector per text chunk
         
         Args:
-            documents: List of document dictionaries with at least 'content' and 'path' fields
+            documents: List of document dictionaries with at least 'chunks' and 'path' fields
+            batch_size: Number of texts embedded per model forward pass
         """
         if not documents:
             return
+        
+        # Skip documents whose content is already indexed under the same path, so
+        # they aren't embedded again, and replace the chunks of changed documents
+        content_hashes = {}
+        new_documents = []
+        for doc in documents:
+            if not doc['chunks']:
+                continue
+            hasher = content_hasher()
+            for chunk in doc['chunks']:
+                hasher.update(chunk.encode('utf-8'))
+                hasher.update(b'\0')
+            content_hash = hasher.hexdigest()
             
-        # Create a new index if one doesn't exist yet
-        if self.index is None:
-            self.index = faiss.IndexFlatL2(self.embedding_dim)
+            path = str(doc['path'])
+            if path in self.document_paths:
+                if self._path_to_hash.get(path) == content_hash:
+                    continue
+                self.remove_document(path)
+            content_hashes[path] = content_hash
+            new_documents.append(doc)
+            
+        # Collect the chunks of all documents
+        texts = []
+        chunk_documents = []
+        for doc in new_documents:
+            texts.extend(doc['chunks'])
+            chunk_documents.extend([doc] * len(doc['chunks']))
         
-        # Generate embeddings for all documents
-        texts = [doc['content'] for doc in documents]
-        embeddings = self._generate_embeddings(texts)
+        if not texts:
+            return
         
-        # Add embeddings to FAISS index
-        document_ids = list(range(len(self.document_metadata), 
-                                len(self.document_metadata) + len(documents)))
+        self._embed_and_add(texts, chunk_documents, batch_size)
         
-        # Convert embeddings to the format FAISS expects
-        faiss_embeddings = np.array(embeddings).astype('float32')
+        with self._lock:
+            self._path_to_hash.update(content_hashes)
+            self._metadata_db.executemany("INSERT OR REPLACE INTO documents (path, hash) VALUES (?, ?)",
+                                          content_hashes.items())
+            self._metadata_db.commit()
+    
+    def _embed_and_add(self, texts: List[str], chunk_documents: List[Dict[str, Any]],
+                       batch_size: int) -> None:
+        """
+        Embed text chunks and add them to the index
         
-        # Add to index
-        self.index.add(faiss_embeddings)
+        Args:
+            texts: Chunk texts
+            chunk_documents: Document each chunk belongs to
+            batch_size: Number of texts embedded per model forward pass
+        """
+        step = self.ADD_PIPELINE_TEXTS
+        if len(texts) <= step:
+            embeddings = self._generate_embeddings(texts, batch_size=batch_size)
+            self._add_embeddings(texts, chunk_documents, embeddings)
+            return
         
-        # Update metadata
-        for i, doc_id in enumerate(document_ids):
-            # Store everything except the full content to save space
-            metadata = {k: v for k, v in documents[i].items() if k != 'content'}
-            # Add a small content preview
-            metadata['content_preview'] = documents[i]['content'][:200] + "..." 
-            self.document_metadata[str(doc_id)] = metadata
+        # Embed the next slice of texts on a background thread while adding the
+        # current one; the model and FAISS both release the GIL while they work
+        with ThreadPoolExecutor(max_workers=1) as encoder:
+            pending = encoder.submit(self._generate_embeddings, texts[:step], batch_size)
+            for start in range(0, len(texts), step):
+                embeddings = pending.result()
+                if start + step < len(texts):
+                    pending = encoder.submit(self._generate_embeddings,
+                                             texts[start + step:start + 2 * step], batch_size)
+                self._add_embeddings(texts[start:start + step], chunk_documents[start:start + step],
+                                     embeddings)
+    
+    def _add_embeddings(self, texts: List[str], chunk_documents: List[Dict[str, Any]],
+                        embeddings: np.ndarray) -> None:
+        """
+        Add embedded text chunks to the index and the metadata store
         
-        # Save updated index and metadata
-        self._save_index()
+        Args:
+            texts: Chunk texts
+            chunk_documents: Document each chunk belongs to
+            embeddings: Embeddings of the chunks
+        """
+        with self._lock:
+            # Create a new index if one doesn't exist yet
+            if self.index is None:
+                self.index = self._create_index()
+            self._make_index_writable()
+        
+            # Add embeddings to FAISS index
+            document_ids = np.arange(self._next_id, self._next_id + len(texts), dtype='int64')
+            self._next_id += len(texts)
+        
+            # Add to index
+            self.index.add_with_ids(embeddings, document_ids)
+            self._added_embeddings.append(embeddings.astype(self._embedding_dtype, copy=False))
+            self._added_ids.append(document_ids)
+            
+            # Stage the embeddings before committing their metadata, so every chunk
+            # with metadata can be restored by the next load
+            self._stage_embeddings(embeddings, document_ids)
+        
+            # Update metadata, with a small preview of each chunk
+            previews = [text[:self.PREVIEW_LENGTH] + "..." if len(text) > self.PREVIEW_LENGTH else text
+                        for text in texts]
+            rows = []
+            document_fields = {}
+            for doc_id, doc, preview in zip(document_ids.tolist(), chunk_documents, previews):
+                # Store everything except the chunk texts to save space, building and
+                # serializing the fields once per document rather than per chunk
+                if id(doc) not in document_fields:
+                    fields = {k: v for k, v in doc.items() if k != 'chunks'}
+                    document_fields[id(doc)] = fields, json_dumps(fields)
+                fields, fields_json = document_fields[id(doc)]
+                
+                metadata = dict(fields, content_preview=preview)
+                self.document_metadata[str(doc_id)] = metadata
+                self._metadata_by_id[doc_id] = metadata
+                self.document_paths.add(metadata['path'])
+                rows.append((doc_id, metadata['path'], preview, fields_json))
+            
+            self._metadata_db.executemany("INSERT OR REPLACE INTO docs (id, path, preview, json) "
+                                          "VALUES (?, ?, ?, ?)", rows)
+            self._metadata_db.commit()
+            
+            # Save a newly trained index right away rather than retraining it on every load
+            if (self.index_type in self.TRAINED_INDEX_TYPES and isinstance(self._base_index(), faiss.IndexFlat)
+                    and self._maybe_train_index()):
+                self._save_index()
+            else:
+                self._record_change()
+            self.generation += 1
+    
+    def embed_query(self, query: str) -> np.ndarray:
+        """
+        Generate the embedding for a search query
+        
+        Args:
+            query: The search query
+            
+        Returns:
+            Query embedding as a float32 vector
+        """
+        return self._generate_embeddings([query])[0]
     
-    def search(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query: str, limit: int = 5, diversity: float = 0.0) -> List[Dict[str, Any]]:
         """
         Search for documents similar to the query
         
         Args:
             query: The search query
             limit: Maximum number of results to return
+            diversity: Weight (0 to 1) of novelty against query similarity when
+                reranking by maximal marginal relevance; 0 keeps the similarity order
             
         Returns:
             List of document metadata dictionaries with similarity scores
@@ -105,36 +385,168 @@ class VectorStore:
             logger.warning("No documents in vector store")
             return []
         
-        # Generate embedding for the query
-        query_embedding = self._generate_embeddings([query])[0]
-        query_embedding = np.array([query_embedding]).astype('float32')
+        return self.search_by_embedding(self.embed_query(query), limit=limit, diversity=diversity)
+    
+    def search_batch(self, queries: List[str], limit: int = 5,
+                     diversity: float = 0.0) -> List[List[Dict[str, Any]]]:
+        """
+        Search for documents similar to each of several queries at once
+        
+        All queries are embedded together and looked up with a single index
+        search, which FAISS spreads over its threads.
+        
+        Args:
+            queries: The search queries
+            limit: Maximum number of results to return per query
+            diversity: Weight (0 to 1) of novelty against query similarity when
+                reranking by maximal marginal relevance; 0 keeps the similarity order
+            
+        Returns:
+            One list of document metadata dictionaries with similarity scores per query
+        """
+        if self.index is None or len(self.document_metadata) == 0:
+            logger.warning("No documents in vector store")
+            return [[] for _ in queries]
+        if not queries:
+            return []
+        
+        return self.search_by_embeddings(self._generate_embeddings(queries, batch_size=64),
+                                         limit=limit, diversity=diversity)
+    
+    def search_by_embedding(self, query_embedding: np.ndarray, limit: int = 5,
+                            diversity: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Search for documents similar to an already computed query embedding
+        
+        Args:
+            query_embedding: Embedding of the search query
+            limit: Maximum number of results to return
+            diversity: Weight (0 to 1) of novelty against query similarity when
+                reranking by maximal marginal relevance; 0 keeps the similarity order
+            
+        Returns:
+            List of document metadata dictionaries with similarity scores
+        """
+        return self.search_by_embeddings(np.asarray(query_embedding).reshape(1, -1),
+                                         limit=limit, diversity=diversity)[0]
+    
+    def search_by_embeddings(self, query_embeddings: np.ndarray, limit: int = 5,
+                             diversity: float = 0.0) -> List[List[Dict[str, Any]]]:
+        """
+        Search for documents similar to each of several already computed query embeddings
+        
+        Args:
+            query_embeddings: Embeddings of the search queries, one per row
+            limit: Maximum number of results to return per query
+            diversity: Weight (0 to 1) of novelty against query similarity when
+                reranking by maximal marginal relevance; 0 keeps the similarity order
+            
+        Returns:
+            One list of document metadata dictionaries with similarity scores per query
+        """
+        if self.index is None or len(self.document_metadata) == 0:
+            logger.warning("No documents in vector store")
+            return [[] for _ in range(len(query_embeddings))]
         
-        # Search FAISS index
-        distances, indices = self.index.search(query_embedding, limit)
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32')
         
-        # Convert to list of results
-        results = []
-        for i, doc_idx in enumerate(indices[0]):
-            if doc_idx < 0 or doc_idx >= len(self.document_metadata):
-                continue  # Skip invalid indices
+        with self._lock:
+            k = limit * self.SEARCH_OVERFETCH
+            if (self.index_type in self.BRUTE_FORCE_INDEX_TYPES and
+                    self.index.ntotal <= self.BRUTE_FORCE_MAX_VECTORS):
+                scores, indices = self._brute_force_search(query_embeddings, k)
+            else:
+                scores, indices = self._index_search(query_embeddings, k)
+        
+            # Convert to lists of results, one per document (its closest chunk),
+            # already ordered by similarity (highest first). Reranking considers
+            # every fetched document rather than only the first `limit`
+            all_results = []
+            for query_embedding, query_indices, query_scores in zip(query_embeddings, indices.tolist(),
+                                                                    scores.tolist()):
+                results = []
+                result_ids = []
+                seen_paths = set()
+                for doc_idx, score in zip(query_indices, query_scores):
+                    metadata = self._metadata_by_id.get(doc_idx)
+                    if metadata is None or metadata['path'] in seen_paths:
+                        continue  # Skip invalid indices and further chunks of a document
+                    seen_paths.add(metadata['path'])
+                    
+                    results.append(dict(metadata, similarity=score))
+                    result_ids.append(doc_idx)
+                    if len(results) == limit and diversity <= 0:
+                        break
                 
-            doc_id = str(doc_idx)
-            if doc_id in self.document_metadata:
-                result = self.document_metadata[doc_id].copy()
-                # Add similarity score (convert distance to similarity)
-                similarity = 1.0 / (1.0 + distances[0][i])
-                result['similarity'] = similarity
-                results.append(result)
+                if diversity > 0 and results:
+                    # Stored embeddings are ordered by id
+                    embeddings = self._stored_embeddings()
+                    rows = np.searchsorted(self._embedding_ids, result_ids)
+                    order = mmr_rerank(query_embedding, embeddings[rows], limit, 1.0 - diversity)
+                    results = [results[i] for i in order]
+                all_results.append(results)
         
-        # Sort by similarity (highest first)
-        results.sort(key=lambda x: x['similarity'], reverse=True)
+        return all_results
+    
+    def _index_search(self, query_embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k chunks most similar to each query with the FAISS index
         
-        return results
+        Returns:
+            Tuple of (cosine similarities, chunk ids), one row per query, highest first
+        """
+        base_index = self._base_index()
+        if isinstance(base_index, faiss.IndexHNSW):
+            base_index.hnsw.efSearch = max(self.HNSW_EF_SEARCH, k)
+        elif isinstance(base_index, faiss.IndexIVF):
+            base_index.nprobe = self.IVF_NPROBE
+        scores, indices = self.index.search(query_embeddings, k)
+        
+        # Embeddings are unit length, so inner product scores are cosine similarities.
+        # Indexes built with L2 distance convert via cos = 1 - d^2 / 2
+        if self.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+            scores = 1.0 - scores / 2.0
+        return scores, indices
+    
+    def _brute_force_search(self, query_embeddings: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k chunks most similar to each query by scoring every stored embedding
+        
+        Returns:
+            Tuple of (cosine similarities, chunk ids), one row per query, highest first
+        """
+        # Score the saved embeddings and those added since in place, rather than
+        # merging them first, one block of chunks per matrix product. Each block's
+        # top k are candidates for the overall top k
+        candidate_scores = []
+        candidate_ids = []
+        for part, part_ids in zip([self._embeddings, *self._added_embeddings],
+                                  [self._embedding_ids, *self._added_ids]):
+            for start in range(0, len(part), self.BRUTE_FORCE_BLOCK_ROWS):
+                rows, scores = cosine_topk(query_embeddings, part[start:start + self.BRUTE_FORCE_BLOCK_ROWS], k)
+                candidate_scores.append(scores)
+                candidate_ids.append(part_ids[start:start + self.BRUTE_FORCE_BLOCK_ROWS][rows])
+        
+        scores = np.concatenate(candidate_scores, axis=1)
+        ids = np.concatenate(candidate_ids, axis=1)
+        top = top_k_indices(scores, min(k, scores.shape[1]))
+        return np.take_along_axis(scores, top, axis=1), np.take_along_axis(ids, top, axis=1)
+    
+    def contains_path(self, document_path: str) -> bool:
+        """
+        Check whether a document path has been indexed
+        
+        Args:
+            document_path: Absolute path of the document
+            
+        Returns:
+            True if the document is in the vector store, False otherwise
+        """
+        return document_path in self.document_paths
     
     def remove_document(self, document_path: str) -> bool:
         """
         Remove a document from the vector store
-        Note: FAISS doesn't support direct removal, so we rebuild the index
         
         Args:
             document_path: Path of the document to remove
@@ -142,72 +554,514 @@ class VectorStore:
         Returns:
             True if document was removed, False otherwise
         """
-        if self.index is None:
+        with self._lock:
+            if self.index is None:
+                return False
+            
+            # Find the chunks of the document
+            document_path = str(document_path)
+            ids_to_remove = np.array([doc_id for doc_id, metadata in self._metadata_by_id.items()
+                                      if metadata['path'] == document_path], dtype='int64')
+        
+            if not len(ids_to_remove):
+                return False  # Document wasn't in the store
+            
+            self._remove_ids(ids_to_remove)
+            
+            for doc_id in ids_to_remove.tolist():
+                del self.document_metadata[str(doc_id)]
+                del self._metadata_by_id[doc_id]
+            self.document_paths.discard(document_path)
+            
+            # The saved index keeps the removed chunks until it is next saved in
+            # full; loading drops them, as their metadata is gone
+            self._metadata_db.execute("DELETE FROM docs WHERE path = ?", (document_path,))
+            self._metadata_db.execute("DELETE FROM documents WHERE path = ?", (document_path,))
+            self._path_to_hash.pop(document_path, None)
+            self._metadata_db.commit()
+            self._record_change()
+        
+            self.generation += 1
+            return True
+    
+    def _create_index(self) -> faiss.Index:
+        """
+        Create an empty FAISS index of the configured type, scoring by cosine similarity
+        
+        The index maps vectors to explicit document ids, so chunks can be removed
+        without renumbering the rest.
+        """
+        if self.index_type == 'sq8':
+            # Store each component as one byte instead of four, cutting index
+            # memory and bandwidth 4x
+            index = faiss.IndexScalarQuantizer(self.embedding_dim, faiss.ScalarQuantizer.QT_8bit,
+                                               faiss.METRIC_INNER_PRODUCT)
+            # The model emits unit-length embeddings, so every component lies in
+            # [-1, 1]; train on those bounds rather than on the first (possibly tiny) batch
+            bounds = np.array([[-1.0] * self.embedding_dim, [1.0] * self.embedding_dim], dtype='float32')
+            index.train(bounds)
+        elif self.index_type == 'fp16':
+            # Half precision halves memory and bandwidth while keeping cosine
+            # rankings stable; embeddings are still computed in FP32
+            index = faiss.IndexScalarQuantizer(self.embedding_dim, faiss.ScalarQuantizer.QT_fp16,
+                                               faiss.METRIC_INNER_PRODUCT)
+        elif self.index_type == 'hnsw':
+            # Store the graph's vectors in half precision too
+            index = faiss.IndexHNSWSQ(self.embedding_dim, faiss.ScalarQuantizer.QT_fp16, self.HNSW_M,
+                                      faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.HNSW_EF_CONSTRUCTION
+        else:
+            # Embeddings are unit length, so the inner product is their cosine similarity
+            index = faiss.IndexFlatIP(self.embedding_dim)
+        
+        return faiss.IndexIDMap2(index)
+    
+    def _make_index_writable(self) -> None:
+        """Replace a memory-mapped, read-only IVF index with an in-memory copy before changing it"""
+        if self._index_mapped:
+            self.index = faiss.read_index(str(self.index_path))
+            self._index_mapped = False
+    
+    def _remove_ids(self, ids_to_remove: np.ndarray) -> None:
+        """Remove chunks from the index and the stored embeddings by id"""
+        self._make_index_writable()
+        embeddings = self._stored_embeddings()
+        keep = ~np.isin(self._embedding_ids, ids_to_remove)
+        step = self.BRUTE_FORCE_BLOCK_ROWS
+        self._embeddings = self._write_embeddings(
+            self.embeddings_work_path,
+            (embeddings[start:start + step][keep[start:start + step]] for start in range(0, len(embeddings), step)),
+            int(keep.sum())
+        )
+        self._embedding_ids = self._embedding_ids[keep]
+        
+        if isinstance(self._base_index(), faiss.IndexHNSW):
+            # HNSW graphs don't support removal, so rebuild from the stored embeddings
+            self.index = self._create_index()
+            if len(self._embeddings):
+                self.index.add_with_ids(self._embeddings.astype('float32'), self._embedding_ids)
+        else:
+            self.index.remove_ids(ids_to_remove)
+    
+    def _base_index(self) -> faiss.Index:
+        """Get the index holding the vectors, unwrapped from its id mapping"""
+        if isinstance(self.index, faiss.IndexIDMap):
+            return faiss.downcast_index(self.index.index)
+        return self.index
+    
+    def _metadata_ids(self) -> np.ndarray:
+        """Get the ids of all indexed chunks, in document metadata order"""
+        return np.fromiter((int(doc_id) for doc_id in self.document_metadata),
+                           dtype='int64', count=len(self.document_metadata))
+    
+    def _maybe_train_index(self) -> bool:
+        """
+        Replace the flat index with a trained IVF, PQ or PCA index once it holds enough vectors
+        
+        Returns:
+            True if the index was replaced, False otherwise
+        """
+        count = self.index.ntotal
+        min_vectors = {
+            'ivf': self.IVF_TRAIN_MIN_VECTORS,
+            'pq': self.PQ_TRAIN_MIN_VECTORS,
+            'pca': self.PCA_TRAIN_MIN_VECTORS,
+        }[self.index_type]
+        if count < min_vectors:
             return False
+        
+        vectors = np.ascontiguousarray(self._stored_embeddings(), dtype='float32')
+        ids = self._embedding_ids
+        
+        # Keep the metric of the vectors collected so far
+        metric = self.index.metric_type
+        if self.index_type == 'pq':
+            index = faiss.IndexPQ(self.embedding_dim, self.PQ_M, self.PQ_NBITS, metric)
+            index.train(vectors)
+            self.index = faiss.IndexIDMap2(index)
+            self.index.add_with_ids(vectors, ids)
+            logger.info(f"Trained PQ index with {self.PQ_M} codes per vector on {count} vectors")
+            return True
+        
+        if self.index_type == 'pca':
+            pca = faiss.PCAMatrix(self.embedding_dim, self.PCA_DIM, 0, True)
+            pca.train(vectors)
+            # Projected vectors are no longer unit length, so normalize them again to
+            # keep inner products cosine similarities. Queries go through the same transforms
+            index = faiss.IndexPreTransform(faiss.NormalizationTransform(self.PCA_DIM, 2.0),
+                                            faiss.IndexFlatIP(self.PCA_DIM))
+            index.prepend_transform(pca)
+            self.index = faiss.IndexIDMap2(index)
+            self.index.add_with_ids(vectors, ids)
+            logger.info(f"Trained PCA projection to {self.PCA_DIM} dimensions on {count} vectors")
+            return True
+        
+        # IVF indexes store ids themselves, without an id mapping
+        nlist = int(4 * np.sqrt(count))
+        quantizer = faiss.IndexFlat(self.embedding_dim, metric)
+        index = faiss.IndexIVFFlat(quantizer, self.embedding_dim, nlist, metric)
+        index.train(vectors)
+        index.add_with_ids(vectors, ids)
+        index.nprobe = self.IVF_NPROBE
+        self.index = index
+        logger.info(f"Trained IVF index with {nlist} lists on {count} vectors")
+        return True
+    
+    def _stored_embeddings(self) -> np.ndarray:
+        """Get the embeddings of all indexed chunks, with their ids in self._embedding_ids"""
+        if self._added_embeddings:
+            # Append the embeddings added since on disk, keeping the result mapped
+            # rather than in memory
+            parts = [self._embeddings, *self._added_embeddings]
+            self._embeddings = self._write_embeddings(self.embeddings_work_path, parts,
+                                                      sum(len(part) for part in parts))
+            self._embedding_ids = np.concatenate([self._embedding_ids, *self._added_ids])
+            self._added_embeddings = []
+            self._added_ids = []
+        return self._embeddings
+    
+    def _stored_embedding_ids(self) -> np.ndarray:
+        """Get the ids of all indexed chunks, without merging the stored embeddings"""
+        return np.concatenate([self._embedding_ids, *self._added_ids])
+    
+    def _write_embeddings(self, path: Path, blocks: Iterable[np.ndarray], count: int) -> np.ndarray:
+        """
+        Write blocks of embeddings one after another to an .npy file and map it read-only
+        
+        Args:
+            path: File to write, replaced once fully written
+            blocks: Embedding blocks, in row order
+            count: Total number of rows in the blocks
             
-        # Find documents to keep
-        docs_to_keep = []
-        paths_to_remove = set([document_path])
+        Returns:
+            The written embeddings, memory-mapped from the file
+        """
+        temp_path = path.with_suffix('.tmp.npy')
+        if count == 0:
+            np.save(temp_path, np.empty((0, self.embedding_dim), dtype=self._embedding_dtype))
+        else:
+            out = np.lib.format.open_memmap(temp_path, mode='w+', dtype=self._embedding_dtype,
+                                            shape=(count, self.embedding_dim))
+            row = 0
+            for block in blocks:
+                out[row:row + len(block)] = block
+                row += len(block)
+            out.flush()
+            del out
+        os.replace(temp_path, path)
+        
+        if count == 0:
+            return np.empty((0, self.embedding_dim), dtype=self._embedding_dtype)
+        return np.load(path, mmap_mode='r')
+    
+    def _reconstruct_embeddings(self) -> None:
+        """Recover the stored embeddings from the index, for stores saved without them"""
+        if isinstance(self.index, faiss.IndexIVF):
+            # Look the vectors up by id through a temporary id -> entry map
+            self._embedding_ids = self._metadata_ids()
+            self._make_index_writable()
+            self.index.set_direct_map_type(faiss.DirectMap.Hashtable)
+            self._embeddings = self.index.reconstruct_batch(self._embedding_ids).astype(self._embedding_dtype)
+            self.index.set_direct_map_type(faiss.DirectMap.NoMap)
+            return
+        
+        base_index = self._base_index()
+        self._embeddings = base_index.reconstruct_n(0, base_index.ntotal).astype(self._embedding_dtype)
+        if isinstance(self.index, faiss.IndexIDMap):
+            self._embedding_ids = faiss.vector_to_array(self.index.id_map)
+        else:
+            # Indexes saved before chunks had explicit ids numbered them by position
+            self._embedding_ids = np.arange(base_index.ntotal, dtype='int64')
+    
+    def _metadata_row(self, doc_id: int, metadata: Dict[str, Any]) -> Tuple[int, str, str, bytes]:
+        """Build the metadata table row of a chunk"""
+        fields = {k: v for k, v in metadata.items() if k != 'content_preview'}
+        return doc_id, metadata['path'], metadata.get('content_preview'), json_dumps(fields)
+    
+    def _record_change(self) -> None:
+        """Count a change to the index, saving it in full every INDEX_SAVE_INTERVAL changes"""
+        self._unsaved_changes += 1
+        if self._unsaved_changes >= self.INDEX_SAVE_INTERVAL:
+            self._save_index()
+    
+    def _stage_embeddings(self, embeddings: np.ndarray, ids: np.ndarray) -> None:
+        """Append embeddings added since the last full save to the staging file"""
+        records = np.empty(len(ids), dtype=self._staging_dtype)
+        records['id'] = ids
+        records['embedding'] = embeddings
+        with open(self.staging_path, 'ab') as f:
+            records.tofile(f)
+    
+    def _merge_staged_embeddings(self) -> bool:
+        """
+        Add the embeddings staged since the last full save to the index
+        
+        Returns:
+            True if the staging file held any embeddings, False otherwise
+        """
+        try:
+            size = self.staging_path.stat().st_size
+        except FileNotFoundError:
+            return False
+        
+        # A record cut short by an interrupted append is ignored
+        count = size // self._staging_dtype.itemsize
+        if count == 0:
+            return False
+        
+        records = np.memmap(self.staging_path, dtype=self._staging_dtype, mode='r', shape=(count,))
+        # Embeddings staged before an interrupted save may already be in the index
+        new_records = records[~np.isin(records['id'], self._stored_embedding_ids())]
+        embeddings = np.ascontiguousarray(new_records['embedding'])
+        ids = np.array(new_records['id'])
+        del records, new_records
         
-        for doc_id, metadata in self.document_metadata.items():
-            if metadata['path'] not in paths_to_remove:
-                docs_to_keep.append((int(doc_id), metadata))
+        if len(ids):
+            if self.index is None:
+                self.index = self._create_index()
+            self._make_index_writable()
+            self.index.add_with_ids(embeddings, ids)
+            self._added_embeddings.append(embeddings.astype(self._embedding_dtype, copy=False))
+            self._added_ids.append(ids)
+            logger.debug(f"Merged {len(ids)} staged embeddings into the FAISS index")
+        return True
+    
+    def _generate_embeddings(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Generate unit-length embeddings for a list of texts
         
-        if len(docs_to_keep) == len(self.document_metadata):
-            return False  # Document wasn't in the store
+        Args:
+            texts: Texts to embed
+            batch_size: Number of full-length texts per forward pass (short texts
+                are batched in larger groups)
             
-        # Rebuild index
-        self.index = None
-        self.document_metadata = {}
+        Returns:
+            Contiguous float32 array of shape (len(texts), embedding_dim), as FAISS expects
+        """
+        if len(texts) <= batch_size:
+            return self._encode(texts, batch_size)
+        
+        # Sort the texts by token length and encode them bucket by bucket. Shorter
+        # buckets use proportionally larger batches, keeping tokens per pass constant
+        max_length = self.model.max_seq_length
+        lengths = np.asarray(self.model.tokenizer(texts, truncation=True, max_length=max_length,
+                                                  return_length=True)['length'])
+        order = np.argsort(lengths, kind='stable')
+        bounds = np.searchsorted(lengths[order], self.LENGTH_BUCKETS, side='right')
         
-        if docs_to_keep:
-            # Create new index
-            self.index = faiss.IndexFlatL2(self.embedding_dim)
+        embeddings = np.empty((len(texts), self.embedding_dim), dtype='float32')
+        start = 0
+        for stop, bucket_length in zip([*bounds, len(texts)], [*self.LENGTH_BUCKETS, max_length]):
+            if stop > start:
+                bucket = order[start:stop]
+                bucket_batch_size = batch_size * max(1, max_length // bucket_length)
+                embeddings[bucket] = self._encode([texts[i] for i in bucket], bucket_batch_size)
+            start = stop
             
-            # Add documents back
-            for doc_id, metadata in sorted(docs_to_keep, key=lambda x: x[0]):
-                self.document_metadata[str(doc_id)] = metadata
+        return embeddings
+    
+    def _load_onnx_session(self, model_path: Path) -> Optional[Any]:
+        """
+        Create an ONNX Runtime session for the first exported model found
+        
+        Args:
+            model_path: Directory of the sentence transformer model
             
-            # Save updated index and metadata
-            self._save_index()
+        Returns:
+            Inference session, or None if onnxruntime or the exported model is missing
+        """
+        if onnxruntime is None:
+            return None
         
-        return True
+        for file_name in self.ONNX_MODEL_FILES:
+            onnx_path = model_path / file_name
+            if not onnx_path.exists():
+                continue
+            try:
+                session = onnxruntime.InferenceSession(str(onnx_path), providers=['CPUExecutionProvider'])
+                logger.info(f"Encoding with ONNX Runtime using {onnx_path}")
+                return session
+            except Exception as e:
+                logger.warning(f"Error loading ONNX model {onnx_path}: {str(e)}")
+        
+        return None
+    
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """Encode texts with the model into a contiguous float32 array of unit-length embeddings"""
+        if self._onnx_session is not None:
+            return self._encode_onnx(texts, batch_size)
+        
+        # inference_mode skips autograd bookkeeping that no_grad still does
+        with torch.inference_mode():
+            embeddings = self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                           normalize_embeddings=True, show_progress_bar=False)
+        
+        # Half precision output is widened once here; float32 output is returned as is
+        return np.ascontiguousarray(embeddings, dtype='float32')
     
-    def _generate_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for a list of texts"""
-        return self.model.encode(texts).tolist()
+    def _encode_onnx(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """Encode texts with the ONNX model, mean pooling and normalizing like the sentence transformer"""
+        input_names = {model_input.name for model_input in self._onnx_session.get_inputs()}
+        embeddings = np.empty((len(texts), self.embedding_dim), dtype='float32')
+        
+        for start in range(0, len(texts), batch_size):
+            tokens = self.model.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                          max_length=self.model.max_seq_length, return_tensors='np')
+            inputs = {name: np.asarray(value, dtype='int64') for name, value in tokens.items()
+                      if name in input_names}
+            token_embeddings = self._onnx_session.run(None, inputs)[0]
+            
+            # Average the token embeddings, ignoring padding
+            mask = tokens['attention_mask'][..., None].astype('float32')
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            embeddings[start:start + len(pooled)] = pooled / np.maximum(norms, 1e-12)
+        
+        return embeddings
     
     def _save_index(self) -> None:
-        """Save the FAISS index and document metadata to disk"""
+        """Save the FAISS index and the raw embeddings to disk in full, then clear the staging file"""
         if self.index is None:
             return
-            
-        # Save FAISS index
-        faiss.write_index(self.index, str(self.index_path))
         
-        # Save document metadata
-        with open(self.metadata_path, 'w') as f:
-            json.dump(self.document_metadata, f, indent=2)
+        embeddings = self._stored_embeddings()
+        
+        # Write new files and swap them in, so an interrupted save leaves the old
+        # ones intact, and the old embeddings may still be memory-mapped
+        temp_path = self.index_path.with_suffix('.tmp')
+        faiss.write_index(self.index, str(temp_path))
+        os.replace(temp_path, self.index_path)
+        
+        # Embeddings merged since the last save are already on disk, in the working
+        # file; otherwise write them out, then map the saved file instead of keeping
+        # a copy in memory
+        if self._is_mapped_from(embeddings, self.embeddings_work_path):
+            os.replace(self.embeddings_work_path, self.embeddings_path)
+            self._embeddings = np.load(self.embeddings_path, mmap_mode='r')
+        elif not (self._is_mapped_from(embeddings, self.embeddings_path) and
+                  embeddings.dtype == self._embedding_dtype):
+            self._embeddings = self._write_embeddings(self.embeddings_path, [embeddings], len(embeddings))
+        
+        temp_path = self.embedding_ids_path.with_suffix('.tmp.npy')
+        np.save(temp_path, self._embedding_ids)
+        os.replace(temp_path, self.embedding_ids_path)
+        
+        # Everything staged is now part of the saved index
+        self.staging_path.unlink(missing_ok=True)
+        self._unsaved_changes = 0
             
         logger.debug(f"Saved vector store to {self.db_path}")
     
+    @staticmethod
+    def _is_mapped_from(array: np.ndarray, path: Path) -> bool:
+        """Check whether an array is memory-mapped from the given file"""
+        return (isinstance(array, np.memmap) and array.filename is not None and
+                os.path.abspath(array.filename) == os.path.abspath(path))
+    
     def _load_index(self) -> None:
-        """Load the FAISS index and document metadata from disk"""
-        # Load FAISS index if it exists
+        """Load the last full save of the FAISS index, then apply the changes made since"""
+        # Load FAISS index if it exists. FAISS can only memory-map the inverted lists
+        # of IVF indexes, so map those read-only and have searches page vectors in as
+        # needed; every other index type is read in full either way
+        self.index = None
+        self._index_mapped = False
         if self.index_path.exists():
-            try:
-                self.index = faiss.read_index(str(self.index_path))
+            if self.index_type == 'ivf':
+                try:
+                    self.index = faiss.read_index(str(self.index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                    # An IVF store that hasn't been trained yet is still a flat index,
+                    # which was read into memory and stays writable
+                    self._index_mapped = isinstance(self.index, faiss.IndexIVF)
+                except Exception as e:
+                    logger.debug(f"Cannot memory-map FAISS index, reading it instead: {str(e)}")
+            if self.index is None:
+                try:
+                    self.index = faiss.read_index(str(self.index_path))
+                except Exception as e:
+                    logger.error(f"Error loading FAISS index: {str(e)}")
+                    self.index = None
+            if self.index is not None:
                 logger.debug(f"Loaded FAISS index with {self.index.ntotal} vectors")
+        
+        # Map the raw embeddings rather than reading them; rows are only paged
+        # in when the index has to be rebuilt. A working file left by an
+        # interrupted run holds nothing the staging file doesn't
+        self.embeddings_work_path.unlink(missing_ok=True)
+        self._embeddings = None
+        self._embedding_ids = None
+        self._added_embeddings = []
+        self._added_ids = []
+        if self.index is not None and self.embeddings_path.exists() and self.embedding_ids_path.exists():
+            try:
+                self._embeddings = np.load(self.embeddings_path, mmap_mode='r')
+                self._embedding_ids = np.load(self.embedding_ids_path)
+                if not len(self._embeddings) == len(self._embedding_ids) == self.index.ntotal:
+                    logger.warning("Stored embeddings don't match the FAISS index, ignoring them")
+                    self._embeddings = None
             except Exception as e:
-                logger.error(f"Error loading FAISS index: {str(e)}")
-                self.index = None
+                logger.error(f"Error loading embeddings: {str(e)}")
+                self._embeddings = None
         
-        # Load document metadata if it exists
+        self._load_metadata()
+        ids = self._metadata_ids()
+        self._next_id = int(ids.max()) + 1 if len(ids) else 0
+        
+        changed = False
+        if self.index is None:
+            self._embeddings = np.empty((0, self.embedding_dim), dtype=self._embedding_dtype)
+            self._embedding_ids = np.empty(0, dtype='int64')
+        elif self._embeddings is None:
+            self._reconstruct_embeddings()
+            changed = True
+        
+        # Indexes saved before chunks had explicit ids numbered them by position;
+        # move their vectors into an index with an id mapping
+        if self.index is not None and not isinstance(self.index, (faiss.IndexIDMap, faiss.IndexIVF)):
+            self.index = self._create_index()
+            self._index_mapped = False
+            if len(self._embeddings):
+                self.index.add_with_ids(np.ascontiguousarray(self._embeddings, dtype='float32'),
+                                        self._embedding_ids)
+            logger.info("Migrated FAISS index to explicit document ids")
+        
+        changed |= self._merge_staged_embeddings()
+        
+        # Drop chunks removed since the last full save, whose metadata is gone
+        if self.index is not None:
+            stored_ids = self._stored_embedding_ids()
+            stale_ids = stored_ids[~np.isin(stored_ids, ids)]
+            if len(stale_ids):
+                self._remove_ids(stale_ids)
+                changed = True
+        
+        if changed:
+            self._save_index()
+        
+        self.generation += 1
+    
+    def _load_metadata(self) -> None:
+        """Load the chunk metadata, importing it from the JSON file older versions wrote"""
         if self.metadata_path.exists():
             try:
-                with open(self.metadata_path, 'r') as f:
-                    self.document_metadata = json.load(f)
-                logger.debug(f"Loaded metadata for {len(self.document_metadata)} documents")
+                legacy_metadata = json_loads(self.metadata_path.read_bytes())
+                self._metadata_db.executemany(
+                    "INSERT OR REPLACE INTO docs (id, path, preview, json) VALUES (?, ?, ?, ?)",
+                    [self._metadata_row(int(doc_id), metadata) for doc_id, metadata in legacy_metadata.items()]
+                )
+                self._metadata_db.commit()
+                self.metadata_path.unlink()
+                logger.info(f"Imported metadata for {len(legacy_metadata)} documents from {self.metadata_path}")
             except Exception as e:
-                logger.error(f"Error loading document metadata: {str(e)}")
-                self.document_metadata = {}
+                logger.error(f"Error importing document metadata: {str(e)}")
+        
+        self.document_metadata = {}
+        for doc_id, preview, data in self._metadata_db.execute("SELECT id, preview, json FROM docs ORDER BY id"):
+            metadata = json_loads(data)
+            if preview is not None:
+                metadata['content_preview'] = preview
+            self.document_metadata[str(doc_id)] = metadata
+        logger.debug(f"Loaded metadata for {len(self.document_metadata)} documents")
+        
+        self.document_paths = {metadata['path'] for metadata in self.document_metadata.values()}
+        self._metadata_by_id = {int(doc_id): metadata for doc_id, metadata in self.document_metadata.items()}
+        self._path_to_hash = dict(self._metadata_db.execute("SELECT path, hash FROM documents"))